@@ -0,0 +1,254 @@
+# api_client.py
+# Cliente de la API de server.py para las ventanas de la GUI.
+#
+# Mantiene un pool de conexiones HTTP/1.1 keep-alive (no se abre una conexión
+# TCP por clic), puede mandar varias peticiones seguidas por la misma
+# conexión antes de leer las respuestas (pipelining) y guarda el ETag de
+# cada GET para que las respuestas sin cambios lleguen como 304 vacíos.
+#
+# Como users.py, los métodos devuelven siempre un dict con "status"; si el
+# servidor no responde se devuelve {"status": "error", "message": ...}.
+import gzip
+import json
+import queue
+import select
+import socket
+import threading
+from urllib.parse import urlencode
+
+DEFAULT_TIMEOUT = 10
+POOL_SIZE = 4
+MAX_LINE = 65536
+
+# GET que se revalidan con su ETag (listas que se refrescan seguido)
+REVALIDATE = ("/listdoctors", "/listappointments", "/freeslots", "/waitingroom")
+
+
+class _Connection:
+    """Una conexión keep-alive: escribe peticiones ya codificadas y lee respuestas"""
+
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile("rb")
+        self.alive = True
+        self.used = False
+
+    def closed_by_server(self):
+        """True si el servidor ya cerró la conexión (p. ej. por inactividad)"""
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            # Sin petición pendiente no debería haber nada para leer: un EOF
+            # o datos sueltos significan que la conexión ya no sirve
+            return bool(readable)
+        except (OSError, ValueError):
+            return True
+
+    def send(self, data, timeout):
+        self.sock.settimeout(timeout)
+        self.used = True
+        self.sock.sendall(data)
+
+    def read_response(self):
+        """(código, headers, cuerpo) de la siguiente respuesta"""
+        line = self.file.readline(MAX_LINE)
+        if not line:
+            raise ConnectionError("Conexión cerrada por el servidor")
+        _version, status, _reason = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = self.file.readline(MAX_LINE)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        body = self.file.read(length) if length else b""
+        if len(body) < length:
+            raise ConnectionError("Respuesta incompleta")
+        if headers.get("content-encoding") == "gzip":
+            body = gzip.decompress(body)
+        if headers.get("connection", "").lower() == "close":
+            self.alive = False
+        return int(status), headers, body
+
+    def close(self):
+        self.alive = False
+        try:
+            self.file.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ApiClient:
+    """Cliente de server.py con pool de conexiones, pipelining y timeouts"""
+
+    def __init__(self, host, port=80, pool_size=POOL_SIZE, timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pool = queue.LifoQueue()
+        # Sesión actual (la da login)
+        self.token = None
+        self.user_id = None
+        self.role = None
+        # GET path -> (ETag, respuesta) para revalidar con If-None-Match
+        self.etags = {}
+        self.etags_lock = threading.Lock()
+
+    # ============================
+    # Transporte
+    # ============================
+
+    def _acquire(self):
+        while True:
+            try:
+                conn = self.pool.get_nowait()
+            except queue.Empty:
+                return _Connection(self.host, self.port, self.timeout)
+            if not conn.closed_by_server():
+                return conn
+            conn.close()
+
+    def _release(self, conn):
+        if conn.alive and self.pool.qsize() < self.pool_size:
+            self.pool.put(conn)
+        else:
+            conn.close()
+
+    def _encode(self, method, path, params, revalidate=True):
+        body = b""
+        if params:
+            query = urlencode(params)
+            if method == "GET":
+                path += "?" + query
+            else:
+                body = query.encode("utf-8")
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", "Accept-Encoding: gzip"]
+        if self.token:
+            lines.append(f"Authorization: Bearer {self.token}")
+        if method == "GET" and revalidate:
+            with self.etags_lock:
+                cached = self.etags.get(path)
+            if cached:
+                lines.append(f"If-None-Match: {cached[0]}")
+        else:
+            lines.append("Content-Type: application/x-www-form-urlencoded")
+            lines.append(f"Content-Length: {len(body)}")
+        return path, ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+    def _decode(self, method, path, status, headers, body):
+        if status == 304:
+            with self.etags_lock:
+                cached = self.etags.get(path)
+            # None: otro hilo vació la caché (logout) mientras tanto
+            return cached[1] if cached else None
+        response = json.loads(body)
+        if method == "GET" and status == 200 and "etag" in headers and path.split("?")[0] in REVALIDATE:
+            with self.etags_lock:
+                self.etags[path] = (headers["etag"], response)
+        return response
+
+    def pipeline(self, requests, timeout=None, revalidate=True):
+        """Mandar varias peticiones (method, path, params) por una conexión.
+
+        Se escriben todas juntas y luego se leen las respuestas en orden, así
+        N peticiones cuestan un solo viaje de ida y vuelta. Con revalidate los
+        GET en caché llevan If-None-Match.
+        """
+        encoded = [(method,) + self._encode(method, path, params, revalidate) for method, path, params in requests]
+        idempotent = all(method == "GET" for method, _, _ in encoded)
+        for attempt in range(2):
+            responses = []
+            conn = None
+            sent = False
+            try:
+                conn = self._acquire()
+                reused = conn.used
+                conn.send(b"".join(data for _, _, data in encoded), timeout or self.timeout)
+                sent = True
+                for method, path, _ in encoded:
+                    responses.append(self._decode(method, path, *conn.read_response()))
+            except (OSError, ValueError) as e:
+                if conn is not None:
+                    conn.close()
+                # Una conexión del pool que el servidor cerró por inactividad
+                # falla antes de la primera respuesta: se reintenta una vez,
+                # salvo que un POST/PUT ya enviado pueda haberse ejecutado
+                # (se agendaría dos veces o daría "Horario ocupado")
+                if attempt == 0 and conn is not None and reused and not responses and (idempotent or not sent):
+                    continue
+                error = {"status": "error", "message": f"Sin conexión con el servidor: {e}"}
+                return [r if r is not None else error for r in responses] + [error] * (len(encoded) - len(responses))
+            self._release(conn)
+            # Un 304 cuya respuesta ya no está en la caché se pide entera
+            return [response if response is not None else self.pipeline([request], timeout, False)[0]
+                    for request, response in zip(requests, responses)]
+
+    def request(self, method, path, params=None, timeout=None):
+        return self.pipeline([(method, path, params)], timeout)[0]
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # ============================
+    # API
+    # ============================
+
+    def register(self, name, user_id, role, password):
+        return self.request("POST", "/register", {"name": name, "id": user_id, "role": role, "password": password})
+
+    def login(self, user_id, password):
+        # El servidor guarda la IP desde la que se inició sesión
+        try:
+            ip = socket.gethostbyname(socket.gethostname())
+        except OSError:
+            ip = "127.0.0.1"
+        resp = self.request("PUT", "/login", {"id": user_id, "password": password, "ip": ip})
+        if resp.get("status") == "ok":
+            self.token, self.user_id, self.role = resp["token"], user_id, resp["role"]
+        return resp
+
+    def logout(self):
+        resp = self.request("PUT", "/logout") if self.token else {"status": "ok"}
+        self.token = self.user_id = self.role = None
+        with self.etags_lock:
+            self.etags.clear()
+        return resp
+
+    def doctors(self, limit=None, after=None):
+        params = {}
+        if limit is not None:
+            params["limit"] = limit
+        if after is not None:
+            params["after"] = after
+        return self.request("GET", "/listdoctors", params)
+
+    def add_appointment(self, doctor_id, date, time):
+        return self.request("POST", "/addappointment", {"doctorid": doctor_id, "date": date, "time": time})
+
+    def appointments(self):
+        """Citas del médico con sesión iniciada"""
+        return self.request("GET", "/listappointments")
+
+    def free_slots(self, doctor_id, first, last):
+        return self.request("GET", "/freeslots", {"id": doctor_id, "from": first, "to": last})
+
+    def ready(self, doctor_id):
+        return self.request("PUT", "/ready", {"doctorid": doctor_id})
+
+    def leave(self, doctor_id):
+        return self.request("PUT", "/leave", {"doctorid": doctor_id})
+
+    def waiting_room(self):
+        return self.request("GET", "/waitingroom")
+
+    def events(self, after=0, wait=25):
+        """Long-poll de eventos del médico (ver server.py /events)"""
+        return self.request("GET", "/events", {"after": after, "timeout": wait}, timeout=wait + self.timeout)
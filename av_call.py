@@ -1,260 +1,351 @@
-# python -m pip install pyaudio
+# python -m pip install pyaudio   (solo para micrófono/parlante)
 # pip install opencv-python
-import socket, threading, pyaudio, cv2, pickle, struct
+import socket, threading, time
+import audio_codec
+import metrics
+from framing import VIDEO, AUDIO, timestamp_us
+from transport import TcpTransport, UdpTransport
+from media_server import SessionTransport, MEDIA_PORT
+from video_pipeline import VideoPipeline, LatestSlot, LATENCY_SAMPLES
+from capture import CaptureHub, Microphone, Speaker, audio_source
+from rate_control import RateController
+from video_codec import VideoEncoder, VIDEO_MODES, negotiate_mode
 
-from PyQt5.QtGui import QPixmap
-from PyQt5 import QtGui
-from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QLabel
 
 # Audio config
 CHUNK = 1024
-FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 44100
 
-class av_server:
-    def __init__(self, label:QLabel, display_width, display_height):
-        self.audio_sock = socket.socket()
-        self.video_sock = socket.socket()
-
-        self.audio_sock.bind(('0.0.0.0', 5000))
-        self.video_sock.bind(('0.0.0.0', 6000))
+# Códecs de audio ofrecidos (en orden de preferencia) y tasa en la red.
+# El dispositivo sigue capturando a RATE; se remuestrea antes de codificar.
+AUDIO_CODECS = ["adpcm", "ulaw", "pcm16"]
+AUDIO_WIRE_RATE = audio_codec.VOICE_RATE
+
+# Video: bitrate objetivo y fps máximos del control de tasa
+VIDEO_BITRATE = 1_000_000
+VIDEO_FPS = 15
+# Modo de video preferido (ver video_codec.py); se usa "full" si el otro
+# lado no lo anuncia
+VIDEO_MODE = "delta"
+
+# Puertos de audio y video (los mismos números para TCP y UDP)
+AUDIO_PORT = 5000
+VIDEO_PORT = 6000
+
+class _av_peer:
+    """Envío/recepción de audio y video común a av_server y av_client.
+
+    Las subclases abren las conexiones y dejan los transportes (TCP o UDP,
+    ver transport.py) en self.audio y self.video.
+
+    Con transport="session" ningún lado escucha: los dos se conectan al
+    servidor de media (media_server.py) en media_server, identificándose con
+    session_id (la sala de la cita) y relay_token (el token de sesión de la
+    API, que el servidor verifica), y el servidor reenvía los streams entre ellos.
+
+    capture_hub, audio_source y audio_sink permiten cambiar la cámara, el
+    micrófono y el parlante por fuentes de capture.py (sintéticas, archivos);
+    audio_source acepta también una descripción como "wav:voz.wav".
+
+    video_mode elige cómo se manda el video: "full", "skip" (los frames sin
+    cambios no se mandan) o "delta" (solo las zonas que cambiaron).
+    """
+    role = "paciente"
+
+    is_client = False
+
+    def __init__(self, label:QLabel, display_width, display_height,
+                 audio_codecs=AUDIO_CODECS, audio_rate=AUDIO_WIRE_RATE, transport="tcp",
+                 capture_hub=None, video_bitrate=VIDEO_BITRATE, video_fps=VIDEO_FPS,
+                 session_id=None, media_server=None, audio_source=None, audio_sink=None,
+                 video_mode=VIDEO_MODE, relay_token=None):
         self.label = label
         self.display_width = display_width
         self.display_height = display_height
-
-        #threading.Event().wait()  # keep main thread alive
-
-    def __audio_handler(self):
-        p = pyaudio.PyAudio()
-        input_stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
-        output_stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, output=True, frames_per_buffer=CHUNK)
+        self.audio_codecs = [c for c in audio_codecs if c in audio_codec.CODECS]
+        self.audio_rate = audio_rate
+        if transport not in ("tcp", "udp", "session"):
+            raise ValueError(f"Transporte desconocido: {transport}")
+        if transport == "session" and (session_id is None or media_server is None):
+            raise ValueError("transport='session' requiere session_id y media_server")
+        self.transport = transport
+        self.session_id = session_id
+        self.relay_token = relay_token
+        self.media_server = media_server
+        self.capture_hub = capture_hub
+        self.video_bitrate = video_bitrate
+        self.video_fps = video_fps
+        if video_mode not in VIDEO_MODES:
+            raise ValueError(f"Modo de video desconocido: {video_mode}")
+        self.video_mode = video_mode
+        self.audio_source = audio_source
+        self.audio_sink = audio_sink
+        self.video_pipeline = None
+        self.rate_controller = None
+        self.video_encoder = None
+        # Métricas de esta llamada (fps, bitrate, descartes, colas, tiempos)
+        self.metrics = metrics.Registry()
+
+    def _new_socket(self):
+        if self.transport == "udp":
+            return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return socket.socket()
+
+    def _connect_session(self):
+        """Abrir los streams de audio y video en el servidor de media"""
+        host, port = self.media_server if isinstance(self.media_server, tuple) else (self.media_server, MEDIA_PORT)
+        self.audio = SessionTransport.connect((host, port), self.session_id, self.role, "audio", self.relay_token)
+        self.video = SessionTransport.connect((host, port), self.session_id, self.role, "video", self.relay_token)
+
+    def _negotiate_audio(self):
+        """Acordar códec y tasa de audio: el cliente ofrece, el servidor elige"""
+        if self.is_client:
+            answer = self.audio.request({"codecs": self.audio_codecs, "rates": [self.audio_rate, RATE]})
+            return answer["codec"], answer["rate"]
+        offer = self.audio.recv_hello()
+        codec = next((c for c in self.audio_codecs if c in offer.get("codecs", [])), "pcm16")
+        rate = self.audio_rate if self.audio_rate in offer.get("rates", []) else RATE
+        self.audio.send_hello({"codec": codec, "rate": rate})
+        return codec, rate
+
+    def _negotiate_video(self):
+        """Handshake del stream de video: cada lado anuncia su tamaño de render
+        y los modos de video que sabe recibir.
+
+        Devuelve ((ancho, alto) del otro lado o None si no lo anunció, modo
+        con el que mandarle video). En UDP el handshake además da a conocer
+        el peer.
+        """
+        hello = {"stream": "video", "width": self.display_width, "height": self.display_height,
+                 "video_modes": list(VIDEO_MODES)}
+        if self.is_client:
+            answer = self.video.request(hello)
+        else:
+            answer = self.video.recv_hello()
+            self.video.send_hello(hello)
+        mode = negotiate_mode(self.video_mode, answer.get("video_modes"))
+        if "width" in answer and "height" in answer:
+            return (answer["width"], answer["height"]), mode
+        return None, mode
+
+    def set_display_size(self, width, height):
+        """Cambiar el tamaño de render y pedir al otro lado que codifique a ese tamaño"""
+        self.display_width, self.display_height = width, height
+        if self.video_pipeline is not None:
+            self.video_pipeline.resize(width, height)
+            self._send_control({"width": width, "height": height})
+
+    def _send_control(self, message):
+        try:
+            self.video.send_control(message)
+        except OSError as e:
+            print("Video control error:", e)
+
+    def _on_video_control(self, message):
+        if "width" in message and "height" in message and self.rate_controller is not None:
+            self.rate_controller.max_size = (message["width"], message["height"])
+        if message.get("keyframe") and self.video_encoder is not None:
+            self.video_encoder.request_keyframe()
+
+    def stats(self):
+        """Métricas de este lado de la llamada ({"nombre{etiquetas}": valor})"""
+        return self.metrics.snapshot()
+
+    def _track_transport(self, stream, transport):
+        self.metrics.gauge("bytes_sent", fn=lambda: transport.bytes_sent, stream=stream)
+        self.metrics.gauge("bytes_received", fn=lambda: transport.bytes_received, stream=stream)
+        self.metrics.gauge("send_backlog", fn=transport.backlog, stream=stream)
+
+    def _audio_handler(self):
+        codec, rate = self._negotiate_audio()
+        print(f"Audio codec: {codec} @ {rate} Hz")
+        source = self.audio_source
+        if source is None:
+            source = Microphone(RATE, CHUNK)
+        elif isinstance(source, str):
+            source = audio_source(source, RATE, CHUNK)
+        sink = self.audio_sink if self.audio_sink is not None else Speaker(RATE, CHUNK)
+        self._track_transport("audio", self.audio)
+        m = self.metrics
 
         def send_audio():
+            encoder = audio_codec.make_codec(codec)
+            resampler = audio_codec.Resampler(RATE, rate)
+            sent = m.counter("frames_sent", stream="audio")
+            cpu = m.gauge("cpu_seconds", thread="audio_send")
+            seq = 0
             while True:
                 try:
-                    data = input_stream.read(CHUNK)
-                    self.conn_audio.sendall(data)
+                    data = source.read()
+                    timestamp = timestamp_us()
+                    self.audio.send(AUDIO, seq, encoder.encode(resampler.process(data)), timestamp)
+                    seq += 1
+                    sent.inc()
+                    cpu.set(time.thread_time())
                 except Exception as e:
                     print("Audio send error:", e)
+                    m.counter("errors", stream="audio", direction="send").inc()
                     break
 
         def recv_audio():
+            decoder = audio_codec.make_codec(codec)
+            resampler = audio_codec.Resampler(rate, RATE)
+            received = m.counter("frames_received", stream="audio")
+            latency = m.histogram("latency_ms", window=LATENCY_SAMPLES, stream="audio")
+            cpu = m.gauge("cpu_seconds", thread="audio_recv")
             while True:
                 try:
-                    data = self.conn_audio.recv(CHUNK)
-                    if not data:
+                    message = self.audio.recv()
+                    if message is None:
                         print("Audio connection closed.")
                         break
-                    output_stream.write(data)
+                    stream, _flags, _seq, timestamp, payload = message
+                    if stream != AUDIO:
+                        continue
+                    sink.write(resampler.process(decoder.decode(payload)))
+                    received.inc()
+                    latency.observe((timestamp_us() - timestamp) / 1000)
+                    cpu.set(time.thread_time())
                 except Exception as e:
                     print("Audio recv error:", e)
+                    m.counter("errors", stream="audio", direction="recv").inc()
                     break
 
         threading.Thread(target=send_audio, daemon=True).start()
         threading.Thread(target=recv_audio, daemon=True).start()
 
-    def __video_handler(self):
-        cap = cv2.VideoCapture(0)
+    def _video_handler(self):
+        peer_size, mode = self._negotiate_video()
+        print(f"Video mode: {mode}")
+        hub = self.capture_hub or CaptureHub.shared(0)
+        self.rate_controller = rate = RateController(self.video_bitrate, max_fps=self.video_fps)
+        rate.max_size = peer_size
+        self._track_transport("video", self.video)
+        m = self.metrics
+        for param in ("fps", "quality", "scale", "bitrate"):
+            m.gauge("video_encoder", fn=lambda param=param: getattr(rate, param), param=param)
+        self.video_encoder = encoder = VideoEncoder(rate, mode)
+        for kind in ("repeated", "deltas", "keyframes"):
+            m.gauge("video_frames_sent", fn=lambda kind=kind: getattr(encoder, kind), kind=kind)
 
         def send_video():
+            # Si el envío va lento se codifica solo el frame más reciente
+            frames = LatestSlot()
+            token = hub.subscribe(lambda frame, timestamp: frames.put((frame, timestamp)))
+            m.gauge("frames_dropped", fn=lambda: frames.dropped, stage="capture")
+            frames_sent = m.counter("frames_sent", stream="video")
+            encode_ms = m.histogram("encode_ms", window=LATENCY_SAMPLES, stream="video")
+            cpu = m.gauge("cpu_seconds", thread="video_send")
+            seq = 0
             while True:
                 try:
-                    ret, frame = cap.read()
-                    if not ret:
+                    rate.pace()
+                    frame, timestamp = frames.get()
+                    start = time.perf_counter()
+                    encoded = encoder.encode(frame)
+                    encode_ms.observe((time.perf_counter() - start) * 1000)
+                    if encoded is None:
                         continue
-                    _, buffer = cv2.imencode('.jpg', frame)
-                    data = pickle.dumps(buffer)
-                    message = struct.pack('!L', len(data)) + data
-                    self.conn_video.sendall(message)
+                    flags, payload = encoded
+                    start = time.monotonic()
+                    sent = self.video.send(VIDEO, seq, payload, timestamp, flags)
+                    rate.on_sent(sent, time.monotonic() - start, self.video.backlog())
+                    seq += 1
+                    frames_sent.inc()
+                    cpu.set(time.thread_time())
                 except Exception as e:
                     print("Video send error:", e)
+                    m.counter("errors", stream="video", direction="send").inc()
                     break
+            hub.unsubscribe(token)
 
-        def recv_video():
-            data = b''
-            payload_size = struct.calcsize("!L")
-            while True:
-                try:
-                    while len(data) < payload_size:
-                        packet = self.conn_video.recv(4096)
-                        if not packet:
-                            print("Video connection closed.")
-                            return
-                        data += packet
-
-                    packed_size = data[:payload_size]
-                    data = data[payload_size:]
-                    frame_size = struct.unpack("!L", packed_size)[0]
-
-                    while len(data) < frame_size:
-                        packet = self.conn_video.recv(4096)
-                        if not packet:
-                            print("Video frame incomplete.")
-                            return
-                        data += packet
-
-                    frame_data = data[:frame_size]
-                    data = data[frame_size:]
-                    frame = pickle.loads(frame_data)
-                    frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
-                    if frame is not None:
-                        qt_img = self.convert_cv_qt(frame)
-                        self.label.setPixmap(qt_img)
-                except Exception as e:
-                    print("Video recv error:", e)
-                    break
+        # Recepción, decodificación y render van en etapas separadas
+        self.video_pipeline = VideoPipeline(self.video, self.label, self.display_width, self.display_height,
+                                            metrics=self.metrics)
+        self.video_pipeline.on_control = self._on_video_control
 
         threading.Thread(target=send_video, daemon=True).start()
-        threading.Thread(target=recv_video, daemon=True).start()
-    
-    def start_server(self):
-        def server_thread():
-            self.audio_sock.listen(1)
-            self.video_sock.listen(1)
-
-            print("Waiting for audio connection...")
-            self.conn_audio, _ = self.audio_sock.accept()
-            print("Audio connected.")
-            print("Waiting for video connection...")
-            self.conn_video, _ = self.video_sock.accept()
-            print("Video connected.")
-
-            self.__audio_handler()
-            self.__video_handler()
-        threading.Thread(target=server_thread, daemon=True).start()
-    
-
-    def convert_cv_qt(self, cv_img):
-        # Convert from an opencv image to QPixmap
-        rgb_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb_image.shape
-        bytes_per_line = ch * w
-        convert_to_Qt_format = QtGui.QImage(rgb_image.data, w, h, bytes_per_line, QtGui.QImage.Format_RGB888)
-        p = convert_to_Qt_format.scaled(self.display_width, self.display_height, Qt.KeepAspectRatio)
-        return QPixmap.fromImage(p)
-        
-
+        self.video_pipeline.start()
 
 
-class av_client:
-    def __init__(self, server_ip,label:QLabel, display_width, display_height):
+class av_server(_av_peer):
+    role = "medico"
 
-        self.audio_sock = socket.socket()
-        self.video_sock = socket.socket()
-        self.server_ip=server_ip
-        self.label = label
-        self.display_width = display_width
-        self.display_height = display_height
+    def __init__(self, label:QLabel, display_width, display_height, **options):
+        super().__init__(label, display_width, display_height, **options)
+        if self.transport != "session":
+            self.audio_sock = self._new_socket()
+            self.video_sock = self._new_socket()
 
+            if self.transport == "tcp":
+                # Poder volver a escuchar enseguida tras cortar una llamada
+                self.audio_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.video_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.audio_sock.bind(('0.0.0.0', AUDIO_PORT))
+            self.video_sock.bind(('0.0.0.0', VIDEO_PORT))
 
         #threading.Event().wait()  # keep main thread alive
-    
-    def __audio_handler(self):
-        p = pyaudio.PyAudio()
-        input_stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
-        output_stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, output=True, frames_per_buffer=CHUNK)
-
-        def send_audio():
-            while True:
-                try:
-                    data = input_stream.read(CHUNK)
-                    self.audio_sock.sendall(data)
-                except Exception as e:
-                    print("Audio send error:", e)
-                    break
 
-        def recv_audio():
-            while True:
-                try:
-                    data = self.audio_sock.recv(CHUNK)
-                    if not data:
-                        print("Audio connection closed.")
-                        break
-                    output_stream.write(data)
-                except Exception as e:
-                    print("Audio recv error:", e)
-                    break
+    def start_server(self):
+        def server_thread():
+            if self.transport == "session":
+                print("Connecting to media server...")
+                self._connect_session()
+                print("Session streams open.")
+            elif self.transport == "udp":
+                # Sin conexión: el peer se conoce con el primer datagrama
+                self.audio = UdpTransport(self.audio_sock)
+                self.video = UdpTransport(self.video_sock)
+            else:
+                self.audio_sock.listen(1)
+                self.video_sock.listen(1)
+
+                print("Waiting for audio connection...")
+                self.audio = TcpTransport(self.audio_sock.accept()[0])
+                print("Audio connected.")
+                print("Waiting for video connection...")
+                self.video = TcpTransport(self.video_sock.accept()[0])
+                print("Video connected.")
+
+            self._audio_handler()
+            self._video_handler()
+        threading.Thread(target=server_thread, daemon=True).start()
 
-        threading.Thread(target=send_audio, daemon=True).start()
-        threading.Thread(target=recv_audio, daemon=True).start()
 
-    def __video_handler(self):
-        cap = cv2.VideoCapture(0)
+class av_client(_av_peer):
+    is_client = True
 
-        def send_video():
-            while True:
-                try:
-                    ret, frame = cap.read()
-                    if not ret:
-                        continue
-                    _, buffer = cv2.imencode('.jpg', frame)
-                    data = pickle.dumps(buffer)
-                    message = struct.pack('!L', len(data)) + data
-                    self.video_sock.sendall(message)
-                except Exception as e:
-                    print("Video send error:", e)
-                    break
-
-        def recv_video():
-            data = b''
-            payload_size = struct.calcsize("!L")
-            while True:
-                try:
-                    while len(data) < payload_size:
-                        packet = self.video_sock.recv(4096)
-                        if not packet:
-                            print("Video connection closed.")
-                            return
-                        data += packet
-
-                    packed_size = data[:payload_size]
-                    data = data[payload_size:]
-                    frame_size = struct.unpack("!L", packed_size)[0]
-
-                    while len(data) < frame_size:
-                        packet = self.video_sock.recv(4096)
-                        if not packet:
-                            print("Video frame incomplete.")
-                            return
-                        data += packet
-
-                    frame_data = data[:frame_size]
-                    data = data[frame_size:]
-                    frame = pickle.loads(frame_data)
-                    frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
-                    if frame is not None:
-                        qt_img = self.convert_cv_qt(frame)
-                        self.label.setPixmap(qt_img)
-                except Exception as e:
-                    print("Video recv error:", e)
-                    break
+    def __init__(self, server_ip,label:QLabel, display_width, display_height, **options):
+        super().__init__(label, display_width, display_height, **options)
+        if self.transport != "session":
+            self.audio_sock = self._new_socket()
+            self.video_sock = self._new_socket()
+        self.server_ip=server_ip
 
-        threading.Thread(target=send_video, daemon=True).start()
-        threading.Thread(target=recv_video, daemon=True).start()
+        #threading.Event().wait()  # keep main thread alive
 
     def connect(self):
         def connect_thread():
             try:
-                self.audio_sock.connect((self.server_ip, 5000))
-                self.video_sock.connect((self.server_ip, 6000))
+                if self.transport == "session":
+                    self._connect_session()
+                elif self.transport == "udp":
+                    self.audio = UdpTransport(self.audio_sock, (self.server_ip, AUDIO_PORT))
+                    self.video = UdpTransport(self.video_sock, (self.server_ip, VIDEO_PORT))
+                else:
+                    self.audio_sock.connect((self.server_ip, AUDIO_PORT))
+                    self.video_sock.connect((self.server_ip, VIDEO_PORT))
+                    self.audio = TcpTransport(self.audio_sock)
+                    self.video = TcpTransport(self.video_sock)
 
                 print("Connected to server.")
 
-                self.__audio_handler()
-                self.__video_handler()
+                self._audio_handler()
+                self._video_handler()
             except:
                 print("Couldn't connect to server")
 
-        
-        threading.Thread(target=connect_thread, daemon=True).start()
 
-    def convert_cv_qt(self, cv_img):
-        # Convert from an opencv image to QPixmap
-        rgb_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb_image.shape
-        bytes_per_line = ch * w
-        convert_to_Qt_format = QtGui.QImage(rgb_image.data, w, h, bytes_per_line, QtGui.QImage.Format_RGB888)
-        p = convert_to_Qt_format.scaled(self.display_width, self.display_height, Qt.KeepAspectRatio)
-        return QPixmap.fromImage(p)
+        threading.Thread(target=connect_thread, daemon=True).start()
@@ -0,0 +1,78 @@
+# bench_audio.py
+# Benchmark de los códecs de audio de av_call: bytes por segundo en la red
+# y CPU de encode/decode por bloque, con una señal sintética tipo voz.
+#
+#   python bench_audio.py --seconds 10 --chunk 1024
+import argparse
+import json
+import time
+import numpy as np
+import audio_codec
+
+DEVICE_RATE = 44100
+
+
+def synthetic_voice(seconds, rate):
+    """Señal de prueba: armónicos de una fundamental que varía + ruido"""
+    t = np.arange(int(seconds * rate)) / rate
+    f0 = 140 + 40 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / rate
+    signal = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t) ** 2
+    noise = np.random.default_rng(0).normal(0, 0.02, len(t))
+    return (np.clip(signal * envelope / 3 + noise, -1, 1) * 20000).astype(np.int16)
+
+
+def run(codec_name, wire_rate, samples, chunk):
+    encoder = audio_codec.make_codec(codec_name)
+    decoder = audio_codec.make_codec(codec_name)
+    down = audio_codec.Resampler(DEVICE_RATE, wire_rate)
+    up = audio_codec.Resampler(wire_rate, DEVICE_RATE)
+    wire_bytes = 0
+    encode_time = decode_time = 0.0
+    chunks = 0
+    for start in range(0, len(samples) - chunk + 1, chunk):
+        pcm = samples[start:start + chunk].tobytes()
+        t0 = time.perf_counter()
+        payload = encoder.encode(down.process(pcm))
+        t1 = time.perf_counter()
+        up.process(decoder.decode(payload))
+        t2 = time.perf_counter()
+        encode_time += t1 - t0
+        decode_time += t2 - t1
+        wire_bytes += len(payload)
+        chunks += 1
+    seconds = chunks * chunk / DEVICE_RATE
+    return {
+        "codec": codec_name,
+        "wire_rate": wire_rate,
+        "bytes_per_second": round(wire_bytes / seconds),
+        "kbit_per_second": round(wire_bytes * 8 / seconds / 1000, 1),
+        "encode_us_per_chunk": round(encode_time / chunks * 1e6, 1),
+        "decode_us_per_chunk": round(decode_time / chunks * 1e6, 1),
+        "cpu_percent": round((encode_time + decode_time) / seconds * 100, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark audio codecs used by av_call.")
+    parser.add_argument("--seconds", type=float, default=10, help="Length of the synthetic signal")
+    parser.add_argument("--chunk", type=int, default=1024, help="Samples per chunk at the device rate")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    samples = synthetic_voice(args.seconds, DEVICE_RATE)
+    results = [run(name, rate, samples, args.chunk)
+               for name in audio_codec.CODECS
+               for rate in (DEVICE_RATE, audio_codec.VOICE_RATE)]
+    print(f"{'codec':8} {'rate':>6} {'kbit/s':>8} {'enc us':>8} {'dec us':>8} {'cpu %':>6}")
+    for r in results:
+        print(f"{r['codec']:8} {r['wire_rate']:>6} {r['kbit_per_second']:>8} "
+              f"{r['encode_us_per_chunk']:>8} {r['decode_us_per_chunk']:>8} {r['cpu_percent']:>6}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# bench_call.py
+# Benchmark de punta a punta de una llamada: av_server y av_client en el
+# mismo proceso, por loopback, con fuentes sin dispositivos (capture.py).
+#
+# Cada frame lleva en la cabecera el timestamp de captura; el receptor lo
+# resta de la hora en que lo muestra (o reproduce, para el audio), así se
+# mide la latencia "glass-to-glass" sin cámara ni pantalla. Reporta fps de
+# encode/decode, latencia p50/p95/p99, bytes en la red y CPU por stream.
+#
+#   python bench_call.py --seconds 20 --transport udp
+#   python bench_call.py --video file:clip.mp4 --audio wav:voz.wav --json call.json
+#   python bench_call.py --video still:640x480@30 --video-mode full   (comparar con delta)
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication, QLabel
+import av_call
+from capture import CaptureHub, NullSink, video_source
+from media_server import MediaServer
+
+MEDIA_BENCH_PORT = 7100
+
+
+def latency_ms(histogram):
+    return {f"p{int(f * 100)}_ms": None if histogram[k] is None else round(histogram[k], 1)
+            for f, k in ((0.50, "p50"), (0.95, "p95"), (0.99, "p99"))}
+
+
+def direction(name, sender, receiver, before, after, seconds):
+    """Resultados de un sentido de la llamada (sender -> receiver), de las métricas"""
+    sent, received = after[sender], after[receiver]
+    sent0, received0 = before[sender], before[receiver]
+
+    def delta(stats, stats0, key, field=None):
+        if field is None:
+            return stats.get(key, 0) - stats0.get(key, 0)
+        return stats[key][field] - stats0[key][field] if key in stats else 0
+
+    def cpu(stats, stats0, *threads):
+        return sum(delta(stats, stats0, f"cpu_seconds{{thread={t}}}") for t in threads)
+
+    def average(stats, stats0, key):
+        count = delta(stats, stats0, key, "count")
+        return round(delta(stats, stats0, key, "sum") / count, 2) if count else None
+
+    frames = delta(sent, sent0, "frames_sent{stream=video}")
+    decoded = delta(received, received0, "frames_decoded{stream=video}")
+    video_cpu = cpu(sent, sent0, "video_send") + cpu(received, received0, "video_receive", "video_decode")
+    audio_cpu = cpu(sent, sent0, "audio_send") + cpu(received, received0, "audio_recv")
+    return {
+        "direction": name,
+        "encode_fps": round(frames / seconds, 1),
+        "encode_ms": average(sent, sent0, "encode_ms{stream=video}"),
+        "decode_fps": round(decoded / seconds, 1),
+        "decode_ms": average(received, received0, "decode_ms{stream=video}"),
+        "render_fps": round(delta(received, received0, "frames_rendered{stream=video}") / seconds, 1),
+        "repeated_fps": round(delta(received, received0, "frames_repeated{stream=video}") / seconds, 1),
+        "keyframe_requests": delta(received, received0, "keyframe_requests{stream=video}"),
+        "video_latency": latency_ms(received["latency_ms{stream=video}"]),
+        "video_kbps": round(delta(sent, sent0, "bytes_sent{stream=video}") * 8 / seconds / 1000, 1),
+        "video_cpu_percent": round(video_cpu / seconds * 100, 1),
+        "audio_chunks_per_s": round(delta(received, received0, "frames_received{stream=audio}") / seconds, 1),
+        "audio_latency": latency_ms(received["latency_ms{stream=audio}"]),
+        "audio_kbps": round(delta(sent, sent0, "bytes_sent{stream=audio}") * 8 / seconds / 1000, 1),
+        "audio_cpu_percent": round(audio_cpu / seconds * 100, 1),
+    }
+
+
+def print_results(results, process_cpu):
+    print(f"{'direction':18} {'enc fps':>7} {'enc ms':>7} {'dec fps':>7} {'dec ms':>7} {'g2g p50':>8} "
+          f"{'p95':>6} {'p99':>6} {'kbit/s':>8} {'cpu %':>6}")
+    for r in results:
+        lat = r["video_latency"]
+        print(f"{r['direction'] + ' video':18} {r['encode_fps']:>7} {r['encode_ms']!s:>7} {r['decode_fps']:>7} "
+              f"{r['decode_ms']!s:>7} {lat['p50_ms']!s:>8} {lat['p95_ms']!s:>6} {lat['p99_ms']!s:>6} "
+              f"{r['video_kbps']:>8} {r['video_cpu_percent']:>6}")
+        lat = r["audio_latency"]
+        print(f"{r['direction'] + ' audio':18} {r['audio_chunks_per_s']:>7} {'':>7} {'':>7} {'':>7} "
+              f"{lat['p50_ms']!s:>8} {lat['p95_ms']!s:>6} {lat['p99_ms']!s:>6} "
+              f"{r['audio_kbps']:>8} {r['audio_cpu_percent']:>6}")
+    print(f"Process CPU: {process_cpu}% of one core")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end loopback benchmark of av_call.")
+    parser.add_argument("--seconds", type=float, default=15, help="Measured duration")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds to run before measuring")
+    parser.add_argument("--transport", choices=["tcp", "udp", "session"], default="tcp")
+    parser.add_argument("--video", default="synthetic:640x480@30", help="Video source (see capture.video_source)")
+    parser.add_argument("--audio", default="synthetic", help="Audio source (see capture.audio_source)")
+    parser.add_argument("--codec", choices=av_call.AUDIO_CODECS, help="Force an audio codec")
+    parser.add_argument("--fps", type=int, default=av_call.VIDEO_FPS, help="Max video fps")
+    parser.add_argument("--bitrate", type=int, default=av_call.VIDEO_BITRATE, help="Video target bitrate")
+    parser.add_argument("--video-mode", choices=av_call.VIDEO_MODES, default=av_call.VIDEO_MODE,
+                        help="How video is sent (see video_codec.py)")
+    parser.add_argument("--size", default="640x360", help="Render size of each side")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    width, _, height = args.size.partition("x")
+    width, height = int(width), int(height)
+    options = {"transport": args.transport, "video_fps": args.fps, "video_bitrate": args.bitrate,
+               "video_mode": args.video_mode}
+    if args.codec:
+        options["audio_codecs"] = [args.codec]
+    if args.transport == "session":
+        MediaServer("127.0.0.1", MEDIA_BENCH_PORT).start_background()
+        options.update(session_id="bench", media_server=("127.0.0.1", MEDIA_BENCH_PORT))
+
+    # Cada lado con su propia fuente, como dos máquinas distintas
+    labels = [QLabel(), QLabel()]
+    server = av_call.av_server(labels[0], width, height, capture_hub=CaptureHub(source=video_source(args.video)),
+                               audio_source=args.audio, audio_sink=NullSink(), **options)
+    client = av_call.av_client("127.0.0.1", labels[1], width, height,
+                               capture_hub=CaptureHub(source=video_source(args.video)),
+                               audio_source=args.audio, audio_sink=NullSink(), **options)
+    server.start_server()
+    QTimer.singleShot(300, client.connect)
+
+    snapshots = {}
+
+    def start_measuring():
+        if server.video_pipeline is None or client.video_pipeline is None:
+            print("La llamada no se estableció")
+            app.exit(1)
+            return
+        # Los percentiles salen de las muestras recientes: descartar el arranque
+        for peer in (server, client):
+            for stream in ("video", "audio"):
+                peer.metrics.histogram("latency_ms", stream=stream).samples.clear()
+        snapshots["before"] = {server: server.stats(), client: client.stats()}
+        snapshots["start"] = (time.monotonic(), time.process_time())
+        QTimer.singleShot(int(args.seconds * 1000), stop_measuring)
+
+    def stop_measuring():
+        snapshots["after"] = {server: server.stats(), client: client.stats()}
+        snapshots["end"] = (time.monotonic(), time.process_time())
+        app.exit(0)
+
+    QTimer.singleShot(int(args.warmup * 1000), start_measuring)
+    if app.exec_() != 0:
+        sys.exit(1)
+
+    seconds = snapshots["end"][0] - snapshots["start"][0]
+    process_cpu = round((snapshots["end"][1] - snapshots["start"][1]) / seconds * 100, 1)
+    before, after = snapshots["before"], snapshots["after"]
+    results = [direction("medico->paciente", server, client, before, after, seconds),
+               direction("paciente->medico", client, server, before, after, seconds)]
+    print_results(results, process_cpu)
+    if args.json:
+        report = {
+            "config": vars(args),
+            "seconds": round(seconds, 2),
+            "process_cpu_percent": process_cpu,
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+# bench_server.py
+# Benchmark de carga de la API de server.py: siembra una población sintética
+# de usuarios y citas, levanta el servidor en local y lo carga con clientes
+# concurrentes (/login, /listdoctors, /addappointment, /logout) midiendo
+# throughput y latencias p50/p95/p99 por operación.
+#
+#   python bench_server.py --users 100000 --appointments 200000 --concurrency 32 --json base.json
+#   python bench_server.py --backend asyncio --json new.json --compare base.json
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+import sessions
+import storage
+from api_client import ApiClient
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+PASSWORD = "bench"
+DEFAULT_MIX = "login=1,listdoctors=6,addappointment=2,logout=1"
+# Límites (ms) de los buckets del histograma de latencias
+HISTOGRAM_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+
+# ============================
+# Población sintética
+# ============================
+
+def seed(directory, users, doctor_ratio, appointments):
+    """Escribir users_db.snapshot y appointments.txt en directory"""
+    doctors = max(1, int(users * doctor_ratio))
+    patients = max(1, users - doctors)
+    # Un solo hash para todos: sembrar un millón de pbkdf2 tardaría horas
+    password = sessions.hash_password(PASSWORD)
+    db = {}
+    for i in range(doctors):
+        db[f"d{i}"] = {"name": f"Doctor {i}", "role": "medico", "password": password}
+    for i in range(patients):
+        db[f"p{i}"] = {"name": f"Paciente {i}", "role": "paciente", "password": password}
+    storage.snapshot_file = os.path.join(directory, "users_db.snapshot")
+    storage.log_file = os.path.join(directory, "users_db.log")
+    storage.compact(db)
+
+    # Citas sin solaparse: cada médico llena su agenda día por día
+    slots_per_day = 20
+    first_day = date.today() + timedelta(days=1)
+    with open(os.path.join(directory, "appointments.txt"), "w", encoding="utf-8") as f:
+        lines = []
+        for n in range(appointments):
+            doctor = n % doctors
+            slot = n // doctors
+            day = first_day + timedelta(days=slot // slots_per_day)
+            minutes = 8 * 60 + (slot % slots_per_day) * 30
+            lines.append(f"p{n % patients}|d{doctor}|{day.isoformat()}|{minutes // 60:02d}:{minutes % 60:02d}\n")
+            if len(lines) >= 10000:
+                f.writelines(lines)
+                lines.clear()
+        f.writelines(lines)
+    return doctors, patients
+
+
+# ============================
+# Servidor
+# ============================
+
+def start_server(directory, port, backend, workers):
+    log = open(os.path.join(directory, "server.log"), "w")
+    process = subprocess.Popen(
+        [sys.executable, SERVER_PATH, "-l", "127.0.0.1", "-p", str(port),
+         "-b", backend, "-w", str(workers), "-r", "0"],
+        cwd=directory, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server.py terminó (ver {log.name})")
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("server.py no empezó a escuchar a tiempo")
+
+
+# ============================
+# Carga
+# ============================
+
+class Worker(threading.Thread):
+    """Un cliente simulado: un paciente que repite operaciones según la mezcla"""
+
+    def __init__(self, host, port, doctors, patients, mix, deadline, seed_value):
+        super().__init__(daemon=True)
+        self.api = ApiClient(host, port, pool_size=1)
+        self.doctors = doctors
+        self.patients = patients
+        self.ops, self.weights = zip(*mix.items())
+        self.deadline = deadline
+        self.random = random.Random(seed_value)
+        self.latencies = {op: [] for op in self.ops}
+        self.rejected = {op: 0 for op in self.ops}
+        self.errors = {op: 0 for op in self.ops}
+
+    def call(self, op):
+        api, rnd = self.api, self.random
+        if op == "logout" and api.token is None:
+            # Sin sesión logout no hace ninguna petición: no se mide
+            return op, None
+        if op == "login" or api.token is None:
+            op = "login"
+            return op, api.login(f"p{rnd.randrange(self.patients)}", PASSWORD)
+        if op == "listdoctors":
+            after = f"d{rnd.randrange(self.doctors)}" if rnd.random() < 0.5 else None
+            return op, api.doctors(limit=50, after=after)
+        if op == "addappointment":
+            day = date.today() + timedelta(days=rnd.randrange(1, 365))
+            minutes = 8 * 60 + rnd.randrange(20) * 30
+            return op, api.add_appointment(f"d{rnd.randrange(self.doctors)}", day.isoformat(),
+                                           f"{minutes // 60:02d}:{minutes % 60:02d}")
+        return op, api.logout()
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            op = self.random.choices(self.ops, self.weights)[0]
+            start = time.perf_counter()
+            op, resp = self.call(op)
+            elapsed = time.perf_counter() - start
+            if resp is None:
+                continue
+            if resp.get("status") == "ok":
+                self.latencies[op].append(elapsed)
+            elif resp.get("message", "").startswith("Sin conexión"):
+                self.errors[op] += 1
+            else:
+                # Respuesta válida del servidor (p. ej. horario ocupado): se
+                # cuenta aparte, un rechazo barato no entra en los percentiles
+                self.rejected[op] += 1
+        self.api.close()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(op, latencies, rejected, errors, seconds):
+    latencies.sort()
+    ms = [v * 1000 for v in latencies]
+    buckets = [0] * (len(HISTOGRAM_MS) + 1)
+    i = 0
+    for v in ms:
+        while i < len(HISTOGRAM_MS) and v > HISTOGRAM_MS[i]:
+            i += 1
+        buckets[i] += 1
+    return {
+        "op": op,
+        "requests": len(ms),
+        "rejected": rejected,
+        "errors": errors,
+        "throughput": round(len(ms) / seconds, 1),
+        "p50_ms": round(percentile(ms, 0.50), 3) if ms else None,
+        "p95_ms": round(percentile(ms, 0.95), 3) if ms else None,
+        "p99_ms": round(percentile(ms, 0.99), 3) if ms else None,
+        "max_ms": round(ms[-1], 3) if ms else None,
+        "histogram": dict(zip([f"<={b}ms" for b in HISTOGRAM_MS] + ["inf"], buckets)),
+    }
+
+
+def drive(host, port, doctors, patients, mix, concurrency, seconds, seed_value=0):
+    deadline = time.monotonic() + seconds
+    workers = [Worker(host, port, doctors, patients, mix, deadline, seed_value + n) for n in range(concurrency)]
+    start = time.monotonic()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.monotonic() - start
+    results = []
+    for op in mix:
+        latencies = [v for w in workers for v in w.latencies[op]]
+        results.append(summarize(op, latencies,
+                                 sum(w.rejected[op] for w in workers),
+                                 sum(w.errors[op] for w in workers), elapsed))
+    total = sum(r["requests"] for r in results)
+    results.append(summarize("all", [v for w in workers for op in mix for v in w.latencies[op]],
+                             sum(r["rejected"] for r in results), sum(r["errors"] for r in results), elapsed))
+    return elapsed, total, results
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        if op not in ("login", "listdoctors", "addappointment", "logout"):
+            raise ValueError(f"Operación desconocida: {op}")
+        mix[op] = float(weight or 1)
+    return mix
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(SERVER_PATH)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_results(results, baseline=None):
+    before = {r["op"]: r for r in baseline["results"]} if baseline else {}
+    print(f"{'op':15} {'req':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rej':>6} {'err':>5}")
+    for r in results:
+        print(f"{r['op']:15} {r['requests']:>8} {r['throughput']:>9} {r['p50_ms']!s:>9} "
+              f"{r['p95_ms']!s:>9} {r['p99_ms']!s:>9} {r['rejected']:>6} {r['errors']:>5}")
+        old = before.get(r["op"])
+        if old and old["p99_ms"] and r["p99_ms"]:
+            print(f"{'  vs baseline':15} {'':>8} {r['throughput'] - old['throughput']:>+9.1f} "
+                  f"{r['p50_ms'] - old['p50_ms']:>+9.3f} {r['p95_ms'] - old['p95_ms']:>+9.3f} "
+                  f"{r['p99_ms'] - old['p99_ms']:>+9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the server.py API.")
+    parser.add_argument("--users", type=int, default=10000, help="Synthetic users to seed")
+    parser.add_argument("--doctor-ratio", type=float, default=0.05, help="Fraction of users that are doctors")
+    parser.add_argument("--appointments", type=int, default=10000, help="Synthetic appointments to seed")
+    parser.add_argument("--dir", help="Working directory for the seeded data (default: a temp dir)")
+    parser.add_argument("--no-seed", action="store_true", help="Reuse the data already in --dir")
+    parser.add_argument("--server", help="host:port of a running server (skips seeding and starting one)")
+    parser.add_argument("-b", "--backend", choices=["simple", "threaded", "asyncio"], default="asyncio")
+    parser.add_argument("-w", "--workers", type=int, default=32, help="Server worker threads")
+    parser.add_argument("-p", "--port", type=int, default=8080, help="Port for the local server")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("-d", "--duration", type=float, default=20, help="Seconds of load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Request mix as op=weight,...")
+    parser.add_argument("--seed", type=int,
+                        help="Random seed of the simulated clients (default: time based, so runs "
+                             "against the same --dir do not repeat their bookings)")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Previous --json output to compare against")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    seed_value = args.seed if args.seed is not None else time.time_ns() % 2 ** 32
+    doctors = max(1, int(args.users * args.doctor_ratio))
+    patients = max(1, args.users - doctors)
+    process = None
+    if args.server:
+        host, _, port = args.server.rpartition(":")
+        port = int(port)
+    else:
+        host, port = "127.0.0.1", args.port
+        directory = args.dir or tempfile.mkdtemp(prefix="bench_server_")
+        os.makedirs(directory, exist_ok=True)
+        if not args.no_seed:
+            start = time.monotonic()
+            seed(directory, args.users, args.doctor_ratio, args.appointments)
+            print(f"Seeded {args.users} users and {args.appointments} appointments "
+                  f"in {time.monotonic() - start:.1f}s ({directory})")
+        start = time.monotonic()
+        process = start_server(directory, port, args.backend, args.workers)
+        print(f"server.py ({args.backend}) ready in {time.monotonic() - start:.1f}s")
+
+    try:
+        elapsed, total, results = drive(host, port, doctors, patients, mix, args.concurrency, args.duration,
+                                        seed_value)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(f"{total} requests in {elapsed:.1f}s with {args.concurrency} clients (seed {seed_value})")
+    print_results(results, baseline)
+    if args.json:
+        report = {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {"backend": args.backend, "workers": args.workers, "concurrency": args.concurrency,
+                       "duration": args.duration, "users": args.users, "appointments": args.appointments,
+                       "doctor_ratio": args.doctor_ratio, "mix": mix, "server": args.server,
+                       "seed": seed_value},
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
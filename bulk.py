@@ -0,0 +1,161 @@
+# bulk.py
+# Importación / exportación masiva de usuarios y citas contra server.py.
+#
+# Los archivos se leen en streaming y se mandan en lotes (cuerpo JSONL) por
+# una sola conexión keep-alive, así el servidor valida y escribe cada lote de
+# una vez en vez de atender una petición por fila.
+#
+# El servidor solo atiende estas rutas desde la misma máquina o con el token
+# de operador (--token o $TELECONSULTA_OPERATOR_TOKEN).
+#
+#   python bulk.py import users usuarios.csv
+#   python bulk.py import appointments appointments.txt
+#   python bulk.py export appointments citas.jsonl
+import argparse
+import csv
+import http.client
+import json
+import os
+import sys
+import time
+from itertools import islice
+from urllib.parse import urlencode
+from users import parseAppointmentLine
+
+USER_FIELDS = ("name", "id", "role", "password")
+APPOINTMENT_FIELDS = ("patient", "doctor", "date", "time")
+FIELDS = {"users": USER_FIELDS, "appointments": APPOINTMENT_FIELDS}
+
+
+def file_format(path, fmt):
+    """Formato explícito o deducido de la extensión (jsonl, csv o txt)"""
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def read_rows(path, kind, fmt):
+    """Filas (dict) de un archivo, leídas de a una"""
+    fields = FIELDS[kind]
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        elif kind == "appointments":
+            # Mismo parser que el servidor: acepta "," y "|" mezclados
+            for line in f:
+                parsed = parseAppointmentLine(line)
+                if parsed and parsed != fields:
+                    yield dict(zip(fields, parsed))
+        else:
+            # Mismo orden de columnas que users.txt; la cabecera es opcional
+            for row in csv.reader(f):
+                row = [value.strip() for value in row]
+                if len(row) >= len(fields) and tuple(row[:len(fields)]) != fields:
+                    yield dict(zip(fields, row))
+
+
+class Connection:
+    """Conexión HTTP keep-alive al servidor"""
+
+    def __init__(self, host, port, timeout=120, token=None):
+        self.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        self.token = token
+
+    def call(self, method, path, params=None, body=b"", content_type="application/x-www-form-urlencoded"):
+        if params:
+            path += "?" + urlencode(params)
+        headers = {"Content-Type": content_type}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        self.conn.request(method, path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        data = json.loads(response.read())
+        if response.status != 200 or data.get("status") != "ok":
+            raise RuntimeError(data.get("message", f"HTTP {response.status}"))
+        return data
+
+
+def import_file(conn, kind, path, fmt, batch):
+    rows = read_rows(path, kind, fmt)
+    imported = rejected = sent = 0
+    start = time.monotonic()
+    while True:
+        chunk = list(islice(rows, batch))
+        if not chunk:
+            break
+        body = "".join([json.dumps(row, separators=(",", ":")) + "\n" for row in chunk]).encode("utf-8")
+        result = conn.call("POST", f"/import{kind}", body=body, content_type="application/x-ndjson")
+        for error in result["errors"]:
+            print(f"  fila {sent + error['row'] + 1}: {error['message']}", file=sys.stderr)
+        imported += result["imported"]
+        rejected += result["rejected"]
+        sent += len(chunk)
+        print(f"{sent} filas enviadas ({imported} importadas, {rejected} rechazadas)")
+    print(f"Listo en {time.monotonic() - start:.1f}s")
+
+
+def pages(conn, kind, roles, page_size):
+    """Filas exportadas, página por página"""
+    if kind == "users":
+        for role in roles:
+            after = None
+            while True:
+                params = {"role": role, "limit": page_size}
+                if after is not None:
+                    params["after"] = after
+                data = conn.call("GET", "/exportusers", params)
+                yield from data["users"]
+                after = data["next"]
+                if after is None:
+                    break
+    else:
+        after = 0
+        while after is not None:
+            data = conn.call("GET", "/exportappointments", {"limit": page_size, "after": after})
+            yield from data["appointments"]
+            after = data["next"]
+
+
+def export_file(conn, kind, path, fmt, page_size, roles):
+    fields = FIELDS[kind] if kind == "appointments" else ("name", "id", "role")
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = None
+        if fmt != "jsonl":
+            writer = csv.writer(f)
+            writer.writerow(fields)
+        for row in pages(conn, kind, roles, page_size):
+            if writer is None:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            else:
+                writer.writerow([row[k] for k in fields])
+            count += 1
+    print(f"{count} filas exportadas a {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export of users and appointments.")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("kind", choices=["users", "appointments"])
+    parser.add_argument("file", help="CSV, JSONL or appointments.txt-style file")
+    parser.add_argument("-s", "--server", default="127.0.0.1", help="Server address")
+    parser.add_argument("-p", "--port", type=int, default=80, help="Server port")
+    parser.add_argument("-f", "--format", choices=["csv", "jsonl", "txt"], help="File format (default: from extension)")
+    parser.add_argument("-n", "--batch", type=int, default=5000, help="Rows per request")
+    parser.add_argument("--roles", default="medico,paciente", help="Roles to export (users)")
+    parser.add_argument("--token", default=os.environ.get("TELECONSULTA_OPERATOR_TOKEN"),
+                        help="Operator token (needed when the server is on another host)")
+    args = parser.parse_args()
+
+    conn = Connection(args.server, args.port, token=args.token)
+    fmt = file_format(args.file, args.format)
+    if args.action == "import":
+        import_file(conn, args.kind, args.file, fmt, args.batch)
+    else:
+        export_file(conn, args.kind, args.file, fmt, args.batch, args.roles.split(","))
+
+
+if __name__ == "__main__":
+    main()
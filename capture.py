@@ -0,0 +1,374 @@
+# capture.py
+# Captura de cámara compartida: un solo hilo lee la cámara y reparte cada
+# frame a todos los consumidores suscritos (encoders de red, preview...).
+#
+# Además de la cámara y el micrófono hay fuentes sin dispositivos (patrón
+# sintético, archivo de video, archivo WAV) para probar y medir el camino de
+# media en máquinas sin cámara ni placa de sonido:
+#   video_source("camera:0" | "synthetic:640x480@30" | "file:clip.mp4")
+#   audio_source("mic" | "synthetic" | "wav:voz.wav", rate, chunk)
+import threading
+import time
+import wave
+import cv2
+import numpy as np
+import audio_codec
+from framing import timestamp_us
+
+
+class CaptureHub:
+    """Dueño único de una cámara.
+
+    Cada frame se captura una vez y se entrega el mismo array NumPy (de solo
+    lectura) a todos los suscriptores, sin copiarlo. Los callbacks corren en
+    el hilo de captura, así que deben ser rápidos: un consumidor lento debe
+    guardar el frame (p. ej. en un LatestSlot) y procesarlo en su propio hilo.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cam_index=0, source=None):
+        self.cam_index = cam_index
+        # Fábrica de la fuente (ver video_source); None = cámara cam_index
+        self.source = source
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.next_token = 0
+        self.thread = None
+        self.running = False
+        self.frames = 0
+
+    @classmethod
+    def shared(cls, cam_index=0):
+        """Hub compartido por todos los consumidores de la misma cámara.
+
+        cam_index puede ser también una descripción de fuente ("synthetic",
+        "file:clip.mp4"...), ver video_source.
+        """
+        with cls._shared_lock:
+            hub = cls._shared.get(cam_index)
+            if hub is None:
+                if isinstance(cam_index, int):
+                    hub = cls(cam_index)
+                else:
+                    hub = cls(source=video_source(cam_index))
+                hub = cls._shared[cam_index] = hub
+            return hub
+
+    def subscribe(self, callback):
+        """Registrar callback(frame, timestamp); devuelve un token para unsubscribe"""
+        with self.lock:
+            token = self.next_token
+            self.next_token += 1
+            self.subscribers[token] = callback
+        self.start()
+        return token
+
+    def unsubscribe(self, token):
+        """Quitar un suscriptor; con el último se apaga la cámara"""
+        with self.lock:
+            self.subscribers.pop(token, None)
+            if not self.subscribers:
+                self.running = False
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+
+    def _active(self):
+        # Un hilo viejo que todavía no vio el stop no sigue si ya se
+        # relanzó la captura con un subscribe nuevo
+        return self.running and self.thread is threading.current_thread()
+
+    def _open(self):
+        if self.source is not None:
+            return self.source()
+        return cv2.VideoCapture(self.cam_index)
+
+    def _capture_loop(self):
+        cap = self._open()
+        if not cap.isOpened():
+            print('No se pudo abrir la cámara', self.cam_index if self.source is None else self.source)
+            with self.lock:
+                if self.thread is threading.current_thread():
+                    self.running = False
+            return
+        try:
+            while self._active():
+                ret, frame = cap.read()
+                if not ret:
+                    time.sleep(0.01)
+                    continue
+                timestamp = timestamp_us()
+                frame.flags.writeable = False
+                self.frames += 1
+                with self.lock:
+                    callbacks = list(self.subscribers.values())
+                for callback in callbacks:
+                    callback(frame, timestamp)
+        finally:
+            cap.release()
+
+
+class Pacer:
+    """Marca el ritmo de una fuente que no lo tiene (archivo, sintética)"""
+
+    def __init__(self, rate):
+        self.period = 1.0 / rate
+        self.next = time.monotonic()
+
+    def wait(self):
+        now = time.monotonic()
+        if self.next > now:
+            time.sleep(self.next - now)
+        elif now - self.next > self.period:
+            # Atrasados: seguir desde ahora en vez de recuperar de golpe
+            self.next = now
+        self.next += self.period
+
+
+# ============================
+# Fuentes de video
+# ============================
+# Tienen la interfaz de cv2.VideoCapture que usa CaptureHub:
+# isOpened(), read() -> (ok, frame BGR) y release().
+
+class SyntheticVideo:
+    """Patrón en movimiento generado a fps fijos (sin cámara).
+
+    Cada frame tiene bordes y texto que cambian, así el JPEG no es trivial
+    de comprimir y el costo de codificación se parece al de una cámara real.
+    Con still=True imita una consulta: fondo quieto con ruido de sensor y
+    solo una zona chica en movimiento.
+    """
+
+    def __init__(self, width=640, height=480, fps=30, still=False):
+        self.width = width
+        self.height = height
+        self.pacer = Pacer(fps)
+        self.count = 0
+        self.still = still
+        y, x = np.mgrid[0:height, 0:width]
+        self.background = np.dstack([(x * 255 // max(1, width - 1)),
+                                     (y * 255 // max(1, height - 1)),
+                                     ((x + y) * 255 // max(1, width + height - 2))]).astype(np.uint8)
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        self.pacer.wait()
+        if self.still:
+            return True, self._still_frame()
+        frame = np.roll(self.background, self.count * 4, axis=1)
+        x = (self.count * 8) % self.width
+        cv2.rectangle(frame, (x, self.height // 3), (x + self.width // 8, 2 * self.height // 3), (255, 255, 255), -1)
+        cv2.putText(frame, str(self.count), (10, self.height - 20), cv2.FONT_HERSHEY_SIMPLEX,
+                    self.height / 240, (0, 0, 0), 2)
+        self.count += 1
+        return True, frame
+
+    def _still_frame(self):
+        if self.count == 0:
+            # Unos pocos cuadros de ruido que se van rotando
+            self.noise = [np.random.default_rng(i).integers(0, 4, self.background.shape, np.uint8)
+                          for i in range(8)]
+        frame = cv2.add(self.background, self.noise[self.count % len(self.noise)])
+        # Un círculo que oscila en el centro, del tamaño de una cara
+        x = self.width // 2 + int(self.width / 16 * np.sin(self.count / 10))
+        cv2.circle(frame, (x, self.height // 2), self.height // 8, (40, 80, 200), -1)
+        self.count += 1
+        return frame
+
+    def release(self):
+        pass
+
+
+class VideoFile:
+    """Archivo de video leído a su velocidad original (en bucle si loop)"""
+
+    def __init__(self, path, loop=True):
+        self.cap = cv2.VideoCapture(path)
+        self.loop = loop
+        self.pacer = Pacer(self.cap.get(cv2.CAP_PROP_FPS) or 30)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        self.pacer.wait()
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return ret, frame
+
+    def release(self):
+        self.cap.release()
+
+
+def video_source(spec):
+    """Fábrica de fuente de video para CaptureHub(source=...).
+
+    "camera:N", "synthetic[:ANCHOxALTO[@FPS]]", "still[:ANCHOxALTO[@FPS]]"
+    (escena casi quieta) o "file:RUTA"; None para la cámara (CaptureHub usa
+    cam_index).
+    """
+    kind, _, arg = str(spec).partition(":")
+    if kind == "camera":
+        index = int(arg or 0)
+        return lambda: cv2.VideoCapture(index)
+    if kind in ("synthetic", "still"):
+        size, _, fps = arg.partition("@")
+        width, _, height = (size or "640x480").partition("x")
+        return lambda: SyntheticVideo(int(width), int(height), float(fps or 30), still=kind == "still")
+    if kind == "file":
+        return lambda: VideoFile(arg)
+    raise ValueError(f"Fuente de video desconocida: {spec}")
+
+
+# ============================
+# Fuentes y salidas de audio
+# ============================
+# Una fuente tiene read() -> bytes de PCM 16 bits mono (chunk muestras) y
+# close(); una salida tiene write(pcm) y close().
+
+_pyaudio = None
+
+
+def _audio_device():
+    """Instancia compartida de PyAudio (solo se importa si se usa)"""
+    global _pyaudio
+    if _pyaudio is None:
+        import pyaudio
+        _pyaudio = pyaudio.PyAudio()
+    return _pyaudio
+
+
+class Microphone:
+    def __init__(self, rate, chunk):
+        import pyaudio
+        self.chunk = chunk
+        self.stream = _audio_device().open(format=pyaudio.paInt16, channels=1, rate=rate,
+                                           input=True, frames_per_buffer=chunk)
+
+    def read(self):
+        return self.stream.read(self.chunk)
+
+    def close(self):
+        self.stream.close()
+
+
+class Speaker:
+    def __init__(self, rate, chunk):
+        import pyaudio
+        self.stream = _audio_device().open(format=pyaudio.paInt16, channels=1, rate=rate,
+                                           output=True, frames_per_buffer=chunk)
+
+    def write(self, pcm):
+        self.stream.write(pcm)
+
+    def close(self):
+        self.stream.close()
+
+
+class SyntheticAudio:
+    """Tono tipo voz (armónicos de una fundamental que varía) en tiempo real"""
+
+    def __init__(self, rate, chunk):
+        self.rate = rate
+        self.chunk = chunk
+        self.pacer = Pacer(rate / chunk)
+        self.phase = 0.0
+        self.t = 0
+
+    def read(self):
+        self.pacer.wait()
+        t = (self.t + np.arange(self.chunk)) / self.rate
+        f0 = 140 + 40 * np.sin(2 * np.pi * 0.7 * t)
+        phase = self.phase + 2 * np.pi * np.cumsum(f0) / self.rate
+        self.phase = phase[-1]
+        self.t += self.chunk
+        signal = sum(np.sin(k * phase) / k for k in range(1, 8)) / 3
+        return (np.clip(signal, -1, 1) * 20000).astype(np.int16).tobytes()
+
+    def close(self):
+        pass
+
+
+class WavFile:
+    """Archivo WAV de 16 bits, pasado a mono y a rate, en tiempo real y en bucle"""
+
+    def __init__(self, path, rate, chunk, loop=True):
+        self.wav = wave.open(path, "rb")
+        if self.wav.getsampwidth() != 2:
+            raise ValueError("Solo se soportan WAV de 16 bits")
+        self.channels = self.wav.getnchannels()
+        self.resampler = audio_codec.Resampler(self.wav.getframerate(), rate)
+        self.chunk = chunk
+        self.loop = loop
+        self.pending = b""
+        self.pacer = Pacer(rate / chunk)
+        # Muestras a leer del archivo por bloque de salida
+        self.read_frames = max(1, int(chunk * self.wav.getframerate() / rate))
+
+    def _next_block(self):
+        data = self.wav.readframes(self.read_frames)
+        if not data and self.loop:
+            self.wav.rewind()
+            data = self.wav.readframes(self.read_frames)
+        if not data:
+            return None
+        if self.channels > 1:
+            samples = np.frombuffer(data, np.int16).reshape(-1, self.channels)
+            data = samples.mean(axis=1).astype(np.int16).tobytes()
+        return self.resampler.process(data)
+
+    def read(self):
+        self.pacer.wait()
+        need = self.chunk * 2
+        while len(self.pending) < need:
+            block = self._next_block()
+            if block is None:
+                # Fin del archivo: completar con silencio
+                self.pending += bytes(need - len(self.pending))
+                break
+            self.pending += block
+        data, self.pending = self.pending[:need], self.pending[need:]
+        return data
+
+    def close(self):
+        self.wav.close()
+
+
+class NullSink:
+    """Salida que descarta el audio (cuenta los bytes)"""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, pcm):
+        self.bytes += len(pcm)
+
+    def close(self):
+        pass
+
+
+def audio_source(spec, rate, chunk):
+    """Fuente de audio: "mic", "synthetic" o "wav:RUTA" """
+    kind, _, arg = spec.partition(":")
+    if kind == "mic":
+        return Microphone(rate, chunk)
+    if kind == "synthetic":
+        return SyntheticAudio(rate, chunk)
+    if kind == "wav":
+        return WavFile(arg, rate, chunk)
+    raise ValueError(f"Fuente de audio desconocida: {spec}")
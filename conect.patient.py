@@ -1,11 +1,15 @@
 # conect.patient.py (VERSIÓN PyQt5, totalmente compatible)
 
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListWidget, QPushButton, QMessageBox
-from PyQt5.QtCore import QTimer
-import json
-from av_call import open_video_window
+from PyQt5.QtCore import pyqtSignal
+import threading
+import time
+from gui_main import VideoWindow
 
 class DoctorConnectWindow(QWidget):
+    # Eventos del servidor (dict), entregados en el hilo de Qt
+    evento_recibido = pyqtSignal(dict)
+
     def __init__(self, client, doctor_id):
         super().__init__()
         self.client = client
@@ -29,33 +33,50 @@ class DoctorConnectWindow(QWidget):
 
         self.setLayout(layout)
 
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.verificar_conexion)
+        # En vez de preguntar cada 2 s, un hilo deja abierta una petición
+        # long-poll a /events y el servidor responde apenas hay un evento
+        self.esperando = False
+        self.ultimo_evento = 0
+        self.evento_recibido.connect(self.procesar_evento)
 
     def listar_citas(self):
         self.lista.clear()
-        try:
-            resp = self.client.getAppointmentsDoctor(self.doctor_id)
-            citas = json.loads(resp)
-            for c in citas:
-                self.lista.addItem(f"{c['hora']} - Paciente {c['paciente']}")
-        except Exception as e:
-            self.lista.addItem(f"Error: {e}")
+        resp = self.client.appointments()
+        if resp.get("status") != "ok":
+            self.lista.addItem(f"Error: {resp.get('message', 'No se pudieron cargar las citas')}")
+            return
+        for c in resp.get("appointments", []):
+            self.lista.addItem(f"{c['date']} {c['time']} - Paciente {c['patient']}")
 
     def iniciar_espera(self):
         QMessageBox.information(self, "Esperando", "Esperando a que el paciente se conecte...")
-        self.timer.start(2000)
-
-    def verificar_conexion(self):
-        try:
-            resp = self.client.checkPatientConnection(self.doctor_id)
-            data = json.loads(resp)
-
-            if data.get("conectado"):
-                paciente = data.get("paciente")
-                QMessageBox.information(self, "Conexión encontrada",
-                                        f"El paciente {paciente} está listo.")
-                self.timer.stop()
-                open_video_window("Doctor", self.doctor_id)
-        except:
-            pass
+        if not self.esperando:
+            self.esperando = True
+            threading.Thread(target=self.escuchar_eventos, daemon=True).start()
+
+    def escuchar_eventos(self):
+        # self.client es un api_client.ApiClient con la sesión del médico
+        while self.esperando:
+            data = self.client.events(self.ultimo_evento)
+            if data.get("status") != "ok":
+                # Servidor caído o reiniciándose: reintentar sin saturarlo
+                time.sleep(2)
+                continue
+            self.ultimo_evento = data.get("last", self.ultimo_evento)
+            for evento in data.get("events", []):
+                self.evento_recibido.emit(evento)
+
+    def procesar_evento(self, evento):
+        if evento.get("type") == "appointment_added":
+            self.lista.addItem(f"{evento['date']} {evento['time']} - Paciente {evento['patient']}")
+        elif evento.get("type") == "patient_ready" and self.esperando:
+            self.esperando = False
+            QMessageBox.information(self, "Conexión encontrada",
+                                    f"El paciente {evento['patient']} está listo.")
+            # La llamada va por el relay, en la sala de la cita que trae el evento
+            self.ventana_video = VideoWindow("medico", self.doctor_id, evento["room"], self.client.token)
+            self.ventana_video.show()
+
+    def closeEvent(self, event):
+        self.esperando = False
+        super().closeEvent(event)
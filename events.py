@@ -0,0 +1,105 @@
+# events.py
+# Eventos por médico ("paciente listo", "cita agregada") para long-poll.
+#
+# Cada evento lleva un id global creciente. Un cliente pide los eventos con
+# id > after; si no hay, la petición queda esperando hasta que llegue uno o
+# se cumpla el timeout. Con el backend asyncio una espera es solo un future,
+# así que miles de médicos esperando no ocupan hilos.
+import asyncio
+import threading
+import time
+from collections import deque
+
+# Eventos que se guardan por médico para los clientes que se reconectan
+HISTORY = 256
+
+
+class EventBus:
+    """Publicación de eventos por médico con esperas en hilos o en asyncio"""
+
+    def __init__(self, history=HISTORY):
+        self.lock = threading.Lock()
+        # Los ids parten de la hora actual (ms) para que sigan creciendo tras
+        # reiniciar el servidor y un cliente con un "after" viejo no pierda eventos
+        self.last_id = int(time.time() * 1000)
+        self.history = {}   # doctor_id -> deque de eventos
+        self.waiters = {}   # doctor_id -> set de callbacks a despertar
+        self.history_size = history
+
+    def publish(self, doctor_id, kind, **data):
+        """Publicar un evento; se puede llamar desde cualquier hilo"""
+        with self.lock:
+            self.last_id += 1
+            event = {"id": self.last_id, "type": kind, **data}
+            events = self.history.get(doctor_id)
+            if events is None:
+                events = self.history[doctor_id] = deque(maxlen=self.history_size)
+            events.append(event)
+            waiters = self.waiters.pop(doctor_id, ())
+        for wake in waiters:
+            wake()
+        return event
+
+    def _since(self, doctor_id, after):
+        if after > self.last_id:
+            # Cursor de un servidor con el reloj adelantado: empezar de cero
+            after = 0
+        events = self.history.get(doctor_id, ())
+        if not events or events[-1]["id"] <= after:
+            return []
+        return [e for e in events if e["id"] > after]
+
+    def _subscribe(self, doctor_id, after, wake):
+        """Eventos pendientes, o [] dejando wake registrado (de forma atómica)"""
+        with self.lock:
+            events = self._since(doctor_id, after)
+            if not events:
+                self.waiters.setdefault(doctor_id, set()).add(wake)
+            return events
+
+    def _unsubscribe(self, doctor_id, wake):
+        with self.lock:
+            waiters = self.waiters.get(doctor_id)
+            if waiters is not None:
+                waiters.discard(wake)
+                if not waiters:
+                    del self.waiters[doctor_id]
+
+    def _result(self, doctor_id, after, events):
+        if not events:
+            with self.lock:
+                events = self._since(doctor_id, after)
+        last = events[-1]["id"] if events else max(after, 0)
+        return {"status": "ok", "events": events, "last": last}
+
+    def wait(self, doctor_id, after=0, timeout=25):
+        """Esperar eventos bloqueando el hilo actual (backend con hilos)"""
+        ready = threading.Event()
+        events = self._subscribe(doctor_id, after, ready.set)
+        if not events:
+            ready.wait(timeout)
+            self._unsubscribe(doctor_id, ready.set)
+        return self._result(doctor_id, after, events)
+
+    async def wait_async(self, doctor_id, after=0, timeout=25):
+        """Esperar eventos sin ocupar un hilo (backend asyncio)"""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        wake = lambda: loop.call_soon_threadsafe(ready.set)
+        events = self._subscribe(doctor_id, after, wake)
+        if not events:
+            try:
+                await asyncio.wait_for(ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._unsubscribe(doctor_id, wake)
+        return self._result(doctor_id, after, events)
+
+    def subscribers(self):
+        with self.lock:
+            return sum(len(w) for w in self.waiters.values())
+
+
+# Bus compartido por users.py y server.py
+bus = EventBus()
@@ -0,0 +1,160 @@
+# framing.py
+# Formato binario de los frames de media y lectura de mensajes con
+# prefijo de longitud sobre un socket TCP.
+import json
+import struct
+import time
+
+# Prefijo de longitud simple (4 bytes, big endian)
+LENGTH_HEADER = struct.Struct('!L')
+
+# ============================
+# Frames de media
+# ============================
+# Cabecera: versión, tipo de stream, flags, número de secuencia,
+# timestamp de captura (microsegundos) y longitud del payload.
+MEDIA_VERSION = 1
+MEDIA_HEADER = struct.Struct('!BBHIQI')
+MEDIA_LENGTH_FIELD = 5
+
+# Tamaño máximo de un mensaje: la longitud viene del otro lado y sin tope
+# un solo peer podría hacer reservar hasta 4 GiB
+MAX_FRAME_SIZE = 8 * 1024 * 1024
+
+# Tipos de stream
+VIDEO = 1
+AUDIO = 2
+CONTROL = 3
+
+# Flags
+FLAG_HELLO = 0x1     # datagrama CONTROL de handshake (transporte UDP)
+FLAG_KEYFRAME = 0x2  # VIDEO: frame completo que reinicia la imagen (modo delta)
+FLAG_DELTA = 0x4     # VIDEO: solo las zonas que cambiaron (ver video_codec.py)
+FLAG_REPEAT = 0x8    # VIDEO: sin payload, la imagen no cambió
+
+
+def timestamp_us():
+    """Timestamp de captura en microsegundos"""
+    return time.time_ns() // 1000
+
+
+def send_media(sock, stream, seq, payload, timestamp=None, flags=0):
+    """Enviar un frame de media sin concatenar cabecera y payload"""
+    if timestamp is None:
+        timestamp = timestamp_us()
+    header = MEDIA_HEADER.pack(MEDIA_VERSION, stream, flags, seq & 0xFFFFFFFF, timestamp, len(payload))
+    total = len(header) + len(payload)
+    sent = sock.sendmsg([header, payload])
+    if sent < total:
+        # Envío parcial (buffer del socket lleno): mandar el resto
+        rest = memoryview(header + bytes(payload))[sent:]
+        sock.sendall(rest)
+    return total
+
+
+# ============================
+# Handshake
+# ============================
+# Al conectar, cada lado puede mandar un mensaje JSON en una sola línea
+# (ofertas de códec, tamaño de render, etc.) antes de los frames de media.
+MAX_HELLO = 4096
+
+
+def send_hello(sock, message):
+    """Enviar un mensaje de handshake"""
+    sock.sendall(json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n")
+
+
+def recv_hello(sock):
+    """Leer un mensaje de handshake byte a byte (sin leer de más del socket)"""
+    data = bytearray()
+    while not data.endswith(b"\n"):
+        byte = sock.recv(1)
+        if not byte:
+            raise ConnectionError("Conexión cerrada durante el handshake")
+        data += byte
+        if len(data) > MAX_HELLO:
+            raise ValueError("Handshake demasiado largo")
+    return json.loads(data)
+
+
+class FrameReader:
+    """Lee mensajes [cabecera con longitud][datos] recibiendo directo en un bytearray.
+
+    Los datos se reciben con recv_into sobre un buffer que se reutiliza (y
+    que solo crece si llega un mensaje más grande que él), así que armar un
+    frame no copia lo ya recibido. read_frame devuelve un memoryview sobre el
+    buffer: es válido hasta la siguiente llamada a read_frame.
+
+    Un mensaje de más de max_size bytes lanza ValueError (hay que cerrar la
+    conexión: el stream ya no está sincronizado).
+    """
+
+    def __init__(self, sock, header=LENGTH_HEADER, length_field=0, size=1 << 16, max_size=MAX_FRAME_SIZE):
+        self.sock = sock
+        self.header = header
+        self.length_field = length_field
+        self.max_size = max_size
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0  # primer byte sin consumir
+        self.end = 0    # fin de los datos recibidos
+
+    def _fill(self, needed):
+        """Asegurar que haya needed bytes desde start; False si se cerró"""
+        if needed > self.max_size:
+            raise ValueError(f"Mensaje demasiado grande: {needed} bytes")
+        if self.start + needed > len(self.buf):
+            pending = self.end - self.start
+            if needed > len(self.buf):
+                # Buffer nuevo: los views entregados antes siguen siendo válidos
+                buf = bytearray(max(needed, 2 * len(self.buf)))
+                view = memoryview(buf)
+                view[:pending] = self.view[self.start:self.end]
+                self.buf, self.view = buf, view
+            else:
+                self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        while self.end - self.start < needed:
+            n = self.sock.recv_into(self.view[self.end:])
+            if n == 0:
+                return False
+            self.end += n
+        return True
+
+    def read(self):
+        """Devolver (campos de la cabecera, payload) o None si se cerró la conexión"""
+        if not self._fill(self.header.size):
+            return None
+        fields = self.header.unpack_from(self.buf, self.start)
+        length = fields[self.length_field]
+        self.start += self.header.size
+        if not self._fill(length):
+            return None
+        frame = self.view[self.start:self.start + length]
+        self.start += length
+        if self.start == self.end:
+            self.start = self.end = 0
+        return fields, frame
+
+    def read_frame(self):
+        """Devolver solo el payload del siguiente mensaje, o None"""
+        message = self.read()
+        return None if message is None else message[1]
+
+
+class MediaReader(FrameReader):
+    """FrameReader para frames con cabecera MEDIA_HEADER"""
+
+    def __init__(self, sock, size=1 << 16):
+        super().__init__(sock, MEDIA_HEADER, MEDIA_LENGTH_FIELD, size)
+
+    def read_media(self):
+        """Devolver (stream, flags, seq, timestamp, payload) o None si se cerró"""
+        message = self.read()
+        if message is None:
+            return None
+        (version, stream, flags, seq, timestamp, _length), payload = message
+        if version != MEDIA_VERSION:
+            raise ValueError(f"Versión de frame no soportada: {version}")
+        return stream, flags, seq, timestamp, payload
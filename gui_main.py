@@ -1,7 +1,8 @@
+import os
 import sys
 import threading
+import json
 import socket
-import struct
 import cv2
 import time
 from PyQt5.QtWidgets import (
@@ -9,8 +10,43 @@ from PyQt5.QtWidgets import (
     QLabel, QMessageBox, QListWidget, QHBoxLayout, QComboBox, QDateEdit, QTimeEdit
 )
 from PyQt5.QtCore import Qt, QDate, QTime, QTimer
-import users
 import av_call
+from api_client import ApiClient
+from framing import MediaReader, send_hello, VIDEO, CONTROL, FLAG_HELLO
+from media_server import SessionTransport, MEDIA_PORT
+from rate_control import RateController
+from video_pipeline import VideoPipeline, LatestSlot, FrameRenderer
+from video_codec import VideoEncoder, VIDEO_MODES, negotiate_mode
+from capture import CaptureHub, NullSink
+
+# Servidor central (API + relay de media). Médico y paciente solo abren
+# conexiones salientes hacia él, así que no necesitan verse entre ellos.
+SERVER_HOST = os.environ.get("TELECONSULTA_SERVER", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("TELECONSULTA_PORT", "80"))
+RELAY_ADDRESS = (SERVER_HOST, MEDIA_PORT)
+
+# Fuentes de captura (ver capture.py): índice de cámara o p. ej. "synthetic",
+# y "mic", "synthetic" o "wav:RUTA" para probar sin dispositivos
+CAMERA = os.environ.get("TELECONSULTA_CAMERA", "0")
+CAMERA = int(CAMERA) if CAMERA.isdigit() else CAMERA
+AUDIO_SOURCE = os.environ.get("TELECONSULTA_AUDIO", "mic")
+
+
+def capture_options():
+    """Cámara, fuente y salida de audio para av_call según la configuración"""
+    return dict(capture_hub=CaptureHub.shared(CAMERA), audio_source=AUDIO_SOURCE,
+                audio_sink=None if AUDIO_SOURCE == "mic" else NullSink())
+
+# Cliente de la API compartido por todas las ventanas (pool keep-alive)
+api = ApiClient(SERVER_HOST, SERVER_PORT)
+
+
+def relay_options(room, token=None):
+    """Opciones de av_call para una llamada por el relay; la sala es la de la cita
+    (la da /ready o /waitingroom) y el relay verifica el token de la sesión
+    (por defecto el de api)"""
+    return dict(transport="session", session_id=room, media_server=RELAY_ADDRESS, relay_token=token or api.token)
+
 
 # Simple helper: start a TCP server to receive JPEG frames and display on a QLabel
 class SimpleVideoReceiver(threading.Thread):
@@ -32,30 +68,17 @@ class SimpleVideoReceiver(threading.Thread):
             print(f"Patient video receiver listening on {self.host}:{self.port}")
             conn, addr = self.sock.accept()
             print(f"Patient connected from {addr}")
-            data = b''
-            payload_size = struct.calcsize('!I')
+            # Anunciar el tamaño de render para que el sender no codifique de más
+            send_hello(conn, {"width": self.label.width(), "height": self.label.height()})
+            reader = MediaReader(conn)
             while self.running:
-                while len(data) < payload_size:
-                    packet = conn.recv(4096)
-                    if not packet:
-                        self.running = False
-                        break
-                    data += packet
-                if not self.running:
+                message = reader.read_media()
+                if message is None:
+                    self.running = False
                     break
-                packed_size = data[:payload_size]
-                data = data[payload_size:]
-                frame_size = struct.unpack('!I', packed_size)[0]
-                while len(data) < frame_size:
-                    packet = conn.recv(4096)
-                    if not packet:
-                        self.running = False
-                        break
-                    data += packet
-                if not self.running:
-                    break
-                frame_data = data[:frame_size]
-                data = data[frame_size:]
+                stream, _flags, _seq, _timestamp, frame_data = message
+                if stream != VIDEO:
+                    continue
                 # decode jpeg
                 nparr = np.frombuffer(frame_data, np.uint8)
                 frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
@@ -79,51 +102,71 @@ class SimpleVideoReceiver(threading.Thread):
         except Exception:
             pass
 
-# Simple sender: captures local camera, encodes frames as JPEG and sends to doctor's receiver
+# Simple sender: captures local camera, encodes frames as JPEG and sends them through the relay
 class SimpleVideoSender(threading.Thread):
-    def __init__(self, server_ip, port=7000, cam_index=0, fps=15):
+    def __init__(self, relay_address, session_id, cam_index=CAMERA, fps=15, capture_hub=None, bitrate=1_000_000,
+                 video_mode=av_call.VIDEO_MODE, token=None):
         super().__init__(daemon=True)
-        self.server_ip = server_ip
-        self.port = port
+        self.relay_address = relay_address
+        self.session_id = session_id
+        self.token = token
         self.cam_index = cam_index
         self.fps = fps
+        self.rate = RateController(bitrate, max_fps=fps)
+        self.capture_hub = capture_hub or CaptureHub.shared(cam_index)
+        self.video_mode = video_mode
         self.running = False
 
     def run(self):
         self.running = True
+        frames = LatestSlot()
+        token = self.capture_hub.subscribe(lambda frame, timestamp: frames.put((frame, timestamp)))
+        transport = None
         try:
-            cap = cv2.VideoCapture(self.cam_index)
-            if not cap.isOpened():
-                print('No se pudo abrir la cámara local')
-                return
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.server_ip, self.port))
-            print(f'Conectado al receiver en {self.server_ip}:{self.port}')
+            transport = SessionTransport.connect(self.relay_address, self.session_id, 'paciente', 'preview', self.token)
+            print(f'Conectado al relay en {self.relay_address[0]}:{self.relay_address[1]}')
+            hello = transport.recv_hello()
+            if "width" in hello and "height" in hello:
+                self.rate.max_size = (hello["width"], hello["height"])
+            encoder = VideoEncoder(self.rate, negotiate_mode(self.video_mode, hello.get("video_modes")))
+            threading.Thread(target=self._read_control, args=(transport, encoder), daemon=True).start()
+            seq = 0
             while self.running:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                ret2, buf = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-                if not ret2:
+                self.rate.pace()
+                frame, timestamp = frames.get()
+                encoded = encoder.encode(frame)
+                if encoded is None:
                     continue
-                data = buf.tobytes()
-                size = struct.pack('!I', len(data))
-                sock.sendall(size + data)
-                time.sleep(1.0 / self.fps)
+                flags, buf = encoded
+                start = time.monotonic()
+                sent = transport.send(VIDEO, seq, buf, timestamp, flags)
+                self.rate.on_sent(sent, time.monotonic() - start, transport.backlog())
+                seq += 1
         except Exception as e:
             print('Sender error', e)
         finally:
+            self.capture_hub.unsubscribe(token)
             try:
-                cap.release()
-            except Exception:
-                pass
-            try:
-                sock.close()
+                if transport:
+                    transport.close()
             except Exception:
                 pass
 
+    def _read_control(self, transport, encoder):
+        """Atender los pedidos de keyframe del receptor"""
+        try:
+            while self.running:
+                message = transport.recv()
+                if message is None:
+                    break
+                stream, flags, _seq, _timestamp, payload = message
+                if stream == CONTROL and not flags & FLAG_HELLO and json.loads(bytes(payload)).get("keyframe"):
+                    encoder.request_keyframe()
+        except Exception:
+            pass
+
 import numpy as np
-from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtGui import QPixmap
 
 class LoginRegisterWindow(QWidget):
     def __init__(self):
@@ -167,11 +210,11 @@ class LoginRegisterWindow(QWidget):
         if not all([name, uid, role, pwd]):
             QMessageBox.warning(self,'Error','Complete todos los campos')
             return
-        resp = users.registerUser(name,uid,role,pwd)
+        resp = api.register(name,uid,role,pwd)
         if resp.get('status')=='ok':
             QMessageBox.information(self,'OK','Usuario registrado')
         else:
-            QMessageBox.warning(self,'Error',str(resp))
+            QMessageBox.warning(self,'Error',resp.get('message', str(resp)))
 
     def login_user(self):
         uid = self.login_id.text().strip()
@@ -179,7 +222,7 @@ class LoginRegisterWindow(QWidget):
         if not uid or not pwd:
             QMessageBox.warning(self,'Error','Ingrese ID y contraseña')
             return
-        resp = users.openSession(uid,pwd,'127.0.0.1')
+        resp = api.login(uid,pwd)
         if resp.get('status')=='ok':
             role = resp.get('role')
             if role=='paciente':
@@ -189,7 +232,7 @@ class LoginRegisterWindow(QWidget):
             self.next_window.show()
             self.close()
         else:
-            QMessageBox.warning(self,'Error','Credenciales incorrectas')
+            QMessageBox.warning(self,'Error',resp.get('message','Credenciales incorrectas'))
 
 class PatientWindow(QWidget):
     def __init__(self, patient_id):
@@ -204,9 +247,16 @@ class PatientWindow(QWidget):
         self.doctors_list = QListWidget()
         layout.addWidget(QLabel('Médicos disponibles:'))
         layout.addWidget(self.doctors_list)
+        doctor_buttons = QHBoxLayout()
         btn_refresh = QPushButton('Listar médicos')
         btn_refresh.clicked.connect(self.list_doctors)
-        layout.addWidget(btn_refresh)
+        doctor_buttons.addWidget(btn_refresh)
+        # El servidor manda los médicos de a una página; "next" es el cursor
+        self.btn_more_doctors = QPushButton('Más médicos')
+        self.btn_more_doctors.clicked.connect(self.more_doctors)
+        doctor_buttons.addWidget(self.btn_more_doctors)
+        layout.addLayout(doctor_buttons)
+        self._doctors_next = None
         form_layout = QHBoxLayout()
         self.date_edit = QDateEdit(); self.date_edit.setDate(QDate.currentDate()); self.date_edit.setCalendarPopup(True)
         self.time_edit = QTimeEdit(); self.time_edit.setTime(QTime.currentTime())
@@ -233,19 +283,46 @@ class PatientWindow(QWidget):
         self._receiver_frame = None
         self._receiver_timer = QTimer()
         self._receiver_timer.timeout.connect(self._update_remote_frame)
+        self._hub = None
+        self._sender = None
+        self._preview_token = None
 
     def logout(self):
+        api.logout()
         self.close()
-        w = LoginRegisterWindow(); w.show()
+        self.login_window = LoginRegisterWindow(); self.login_window.show()
+
+    def closeEvent(self, event):
+        self._stop_preview()
+        super().closeEvent(event)
+
+    def _stop_preview(self):
+        # Soltar la cámara: con el último suscriptor el hub deja de capturar
+        if self._preview_token is not None:
+            self._preview_timer.stop()
+            self._hub.unsubscribe(self._preview_token)
+            self._preview_token = None
+        if self._sender is not None:
+            self._sender.running = False
+            self._sender = None
 
     def list_doctors(self):
         self.doctors_list.clear()
-        resp = users.doctorsList(self.patient_id)
+        self._load_doctors(api.doctors())
+
+    def more_doctors(self):
+        if self._doctors_next is not None:
+            self._load_doctors(api.doctors(after=self._doctors_next))
+
+    def _load_doctors(self, resp):
         if resp.get('status')=='ok':
             for d in resp.get('doctors',[]):
                 self.doctors_list.addItem(f"{d['id']} - {d['name']}")
+            self._doctors_next = resp.get('next')
         else:
             self.doctors_list.addItem('Error cargando médicos')
+            self._doctors_next = None
+        self.btn_more_doctors.setEnabled(self._doctors_next is not None)
 
     def schedule_appointment(self):
         cur = self.doctors_list.currentItem()
@@ -253,40 +330,48 @@ class PatientWindow(QWidget):
         doc = cur.text().split(' - ')[0]
         date = self.date_edit.date().toString('yyyy-MM-dd')
         time = self.time_edit.time().toString('HH:mm')
-        resp = users.addAppointment(self.patient_id, doc, date, time)
+        resp = api.add_appointment(doc, date, time)
         if resp.get('status')=='ok': QMessageBox.information(self,'OK','Cita agendada')
-        else: QMessageBox.warning(self,'Error','No se pudo agendar')
+        else: QMessageBox.warning(self,'Error',resp.get('message','No se pudo agendar'))
 
     def start_av_call(self):
         cur = self.doctors_list.currentItem()
         if not cur: QMessageBox.warning(self,'Error','Seleccione un médico'); return
         doctor_id = cur.text().split(' - ')[0]
-
-        doctor_ip = "172.20.10.3"
-        
-
-        self.av_client = av_call.av_client('172.20.10.3', self.remote_label, 480, 270)
+        # Avisar al médico (evento patient_ready en su long-poll); la
+        # respuesta trae la sala de la cita en el relay
+        resp = api.ready(doctor_id)
+        if resp.get('status') != 'ok':
+            QMessageBox.warning(self,'Error',resp.get('message','No se pudo iniciar la llamada')); return
+        room = resp['room']
+
+        # Una sola captura de cámara para la llamada, el sender y el preview
+        self._stop_preview()
+        self._hub = CaptureHub.shared(CAMERA)
+
+        self.av_client = av_call.av_client(SERVER_HOST, self.remote_label, 480, 270,
+                                           **relay_options(room), **capture_options())
         threading.Thread(target=self.av_client.connect, daemon=True).start()
 
-        self._sender = SimpleVideoSender('172.20.10.3', port=7000, cam_index=0, fps=10)
+        self._sender = SimpleVideoSender(RELAY_ADDRESS, room, fps=10, capture_hub=self._hub, token=api.token)
         self._sender.start()
 
-        self._cap = cv2.VideoCapture(0)
+        self._preview_frame = None
+        self._preview_renderer = FrameRenderer(240, 135)
+        self._preview_token = self._hub.subscribe(self._on_preview_frame)
         self._preview_timer = QTimer()
         self._preview_timer.timeout.connect(self._update_local_preview)
         self._preview_timer.start(100)
 
+    def _on_preview_frame(self, frame, timestamp):
+        # Hilo de captura: solo guardar la referencia, el timer la muestra
+        self._preview_frame = frame
+
     def _update_local_preview(self):
-        if hasattr(self,'_cap') and self._cap.isOpened():
-            ret, frame = self._cap.read()
-            if not ret: return
-            frame = cv2.resize(frame, (240,135))
-            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            h,w,ch = rgb.shape
-            bytes_per_line = ch*w
-            img = QImage(rgb.data, w, h, bytes_per_line, QImage.Format_RGB888)
-            pix = QPixmap.fromImage(img)
-            self.local_label.setPixmap(pix)
+        frame = self._preview_frame
+        if frame is not None:
+            _index, image, _array = self._preview_renderer.render(frame)
+            self.local_label.setPixmap(QPixmap.fromImage(image))
 
     def _update_remote_frame(self):
         pass
@@ -315,11 +400,15 @@ class DoctorWindow(QWidget):
         self._receiver_timer.timeout.connect(self._poll_receiver_frame)
 
     def logout(self):
-        w = LoginRegisterWindow(); w.show(); self.close()
+        api.logout()
+        self.login_window = LoginRegisterWindow(); self.login_window.show(); self.close()
 
     def list_appointments(self):
-        resp = users.listAppointments(self.doctor_id)
+        # Citas y sala de espera en un solo viaje (pipelining)
+        resp, waiting = api.pipeline([('GET', '/listappointments', None), ('GET', '/waitingroom', None)])
         self.appt_list.clear()
+        for p in waiting.get('patients', []):
+            self.appt_list.addItem(f"En espera desde {p['since']} - Paciente {p['patient']} ({p['name']})")
         if resp.get('status')=='ok':
             for a in resp.get('appointments',[]):
                 self.appt_list.addItem(f"{a['date']} {a['time']} - Paciente {a['patient']}")
@@ -327,46 +416,21 @@ class DoctorWindow(QWidget):
             self.appt_list.addItem('Error cargando citas')
 
     def start_av_server(self):
-        self.vw = VideoWindow('medico', self.doctor_id)
+        # Se atiende al primero que llegó a la sala de espera, en la sala de su cita
+        waiting = api.waiting_room().get('patients', [])
+        if not waiting:
+            QMessageBox.information(self,'Sala de espera','No hay pacientes esperando'); return
+        room = waiting[0]['room']
+        self.vw = VideoWindow('medico', self.doctor_id, room)
         self.vw.show()
 
         def receiver_loop():
             try:
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,1)
-                s.bind(('0.0.0.0',7000))
-                s.listen(1)
-                print('Receiver listening on 7000')
-                conn,addr = s.accept()
-                print('Patient connected',addr)
-                data=b''
-                payload_size = struct.calcsize('!I')
-                while True:
-                    while len(data)<payload_size:
-                        packet = conn.recv(4096)
-                        if not packet:
-                            return
-                        data+=packet
-                    packed_size = data[:payload_size]; data=data[payload_size:]
-                    frame_size = struct.unpack('!I', packed_size)[0]
-                    while len(data)<frame_size:
-                        packet = conn.recv(4096)
-                        if not packet:
-                            return
-                        data+=packet
-                    frame_data = data[:frame_size]; data=data[frame_size:]
-                    nparr = np.frombuffer(frame_data, np.uint8)
-                    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                    if frame is None: continue
-                    frame = cv2.resize(frame, (480,270))
-                    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    h,w,ch = rgb.shape
-                    bytes_per_line = ch*w
-                    img = QImage(rgb.data, w, h, bytes_per_line, QImage.Format_RGB888)
-                    pix = QPixmap.fromImage(img)
-                    def set_pix():
-                        self.remote_patient_label.setPixmap(pix)
-                    QTimer.singleShot(0, set_pix)
+                transport = SessionTransport.connect(RELAY_ADDRESS, room, 'medico', 'preview', api.token)
+                print('Waiting for patient preview in', room)
+                transport.send_hello({"width": 480, "height": 270, "video_modes": list(VIDEO_MODES)})
+                self._video_pipeline = VideoPipeline(transport, self.remote_patient_label, 480, 270)
+                self._video_pipeline.start()
             except Exception as e:
                 print('Receiver error', e)
 
@@ -376,31 +440,99 @@ class DoctorWindow(QWidget):
         pass
 
 class VideoWindow(QWidget):
-    def __init__(self, role, peer_id, server_ip=None):
+    def __init__(self, role, peer_id, session_id, token=None):
         super().__init__()
         self.role = role
         self.peer_id = peer_id
-        self.server_ip = server_ip
+        self.session_id = session_id
+        self.token = token
         self.setWindowTitle(f'AV Call - {role} {peer_id}')
         self.setGeometry(300,200,640,480)
         layout = QVBoxLayout()
         self.video_label = QLabel('Video')
         self.video_label.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.video_label)
+        # Estadísticas de la llamada sobre el video (opcional)
+        self.stats_label = QLabel(self.video_label)
+        self.stats_label.setStyleSheet('background-color: rgba(0, 0, 0, 160); color: white;'
+                                       'font-family: monospace; font-size: 10px; padding: 4px;')
+        self.stats_label.move(8, 8)
+        self.stats_label.hide()
+        self._stats_prev = None
+        self._stats_timer = QTimer(self)
+        self._stats_timer.timeout.connect(self._update_stats)
+        buttons = QHBoxLayout()
+        btn_stats = QPushButton('Estadísticas')
+        btn_stats.setCheckable(True)
+        btn_stats.toggled.connect(self._toggle_stats)
+        buttons.addWidget(btn_stats)
         btn_close = QPushButton('Cerrar')
         btn_close.clicked.connect(self.close)
-        layout.addWidget(btn_close)
+        buttons.addWidget(btn_close)
+        layout.addLayout(buttons)
         self.setLayout(layout)
+        self.av = None
         threading.Thread(target=self._start_av, daemon=True).start()
 
     def _start_av(self):
         w = 640; h = 360
+        relay = dict(relay_options(self.session_id, self.token), **capture_options())
         if self.role=='medico':
-            srv = av_call.av_server(self.video_label, w, h)
-            srv.start_server()
+            self.av = av_call.av_server(self.video_label, w, h, **relay)
+            self.av.start_server()
+        else:
+            self.av = av_call.av_client(SERVER_HOST, self.video_label, w, h, **relay)
+            self.av.connect()
+
+    def _toggle_stats(self, on):
+        self.stats_label.setVisible(on)
+        self._stats_prev = None
+        if on:
+            self._update_stats()
+            self._stats_timer.start(1000)
         else:
-            cli = av_call.av_client(self.server_ip, self.video_label, w, h)
-            cli.connect()
+            self._stats_timer.stop()
+
+    def _update_stats(self):
+        if self.av is None:
+            self.stats_label.setText('Conectando...')
+            self.stats_label.adjustSize()
+            return
+        now, cur = time.monotonic(), self.av.stats()
+        prev = self._stats_prev
+        self._stats_prev = (now, cur)
+        if prev is None:
+            return
+        seconds = max(now - prev[0], 1e-3)
+
+        def rate(key, scale=1):
+            return (cur.get(key, 0) - prev[1].get(key, 0)) * scale / seconds
+
+        def ms(key, field='p95'):
+            value = cur.get(key, {}).get(field)
+            return '-' if value is None else f'{value:.1f}'
+
+        dropped = sum(v for k, v in cur.items() if k.startswith('frames_dropped'))
+        lines = [
+            f"video tx {rate('frames_sent{stream=video}'):4.1f} fps {rate('bytes_sent{stream=video}', 8e-3):6.0f} kbit/s"
+            f"  q{cur.get('video_encoder{param=quality}', '-')} x{cur.get('video_encoder{param=scale}', '-')}"
+            f"  enc {ms('encode_ms{stream=video}', 'p50')} ms",
+            f"video rx {rate('frames_rendered{stream=video}'):4.1f} fps {rate('bytes_received{stream=video}', 8e-3):6.0f} kbit/s"
+            f"  dec {ms('decode_ms{stream=video}', 'p50')} ms  lat p95 {ms('latency_ms{stream=video}')} ms",
+            f"audio    {rate('frames_received{stream=audio}'):4.1f} /s  {rate('bytes_received{stream=audio}', 8e-3):6.0f} kbit/s"
+            f"  lat p95 {ms('latency_ms{stream=audio}')} ms",
+            f"descartados {dropped}  cola envío {cur.get('send_backlog{stream=video}', 0)} B"
+            f"  decode/render {cur.get('queue_depth{stage=decode}', 0)}/{cur.get('queue_depth{stage=render}', 0)}",
+        ]
+        self.stats_label.setText('\n'.join(lines))
+        self.stats_label.adjustSize()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        # El otro lado pasa a codificar al nuevo tamaño del label
+        if self.av is not None:
+            size = self.video_label.size()
+            self.av.set_display_size(size.width(), size.height())
 
 def main():
     app = QApplication(sys.argv)
@@ -0,0 +1,277 @@
+# media_server.py
+# Servidor de media multi-sesión / relay: un solo puerto, muchas consultas a
+# la vez. Médico y paciente se conectan hacia afuera (no necesitan verse
+# entre ellos) y el servidor reenvía los frames sin decodificarlos.
+#
+# Cada conexión abre con una línea JSON
+#   {"session": "<sala>", "role": "medico"|"paciente", "stream": "audio"|"video"|"preview",
+#    "token": "<token de sesión de la API>"}
+# y el servidor responde {"status": "ok"} o un error. Con authorize (p. ej.
+# users.roomAccess cuando corre dentro de server.py) solo entran el médico y
+# el paciente de la cita; sin él, cualquiera que conozca la sala (pruebas). A partir de ahí la
+# conexión lleva frames de media (framing.MEDIA_HEADER) y el servidor los
+# reenvía tal cual al otro participante de la misma sesión y stream.
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+from collections import deque
+from framing import (MEDIA_HEADER, MEDIA_LENGTH_FIELD, MEDIA_VERSION, MAX_FRAME_SIZE, CONTROL, FLAG_HELLO,
+                     send_hello, recv_hello)
+from transport import TcpTransport
+
+MEDIA_PORT = 7100
+ROLES = ("medico", "paciente")
+STREAMS = ("audio", "video", "preview")
+
+# Bytes que se pueden acumular hacia un participante lento (o que aún no se
+# conectó) antes de empezar a descartar sus frames más viejos; los mensajes
+# CONTROL, como el handshake, no se descartan
+QUEUE_LIMITS = {"audio": 16 * 1024, "video": 512 * 1024, "preview": 512 * 1024}
+# Buffer del socket de salida: chico, para que el exceso quede en la cola
+WRITE_BUFFER_HIGH = 64 * 1024
+
+
+class FrameQueue:
+    """Cola de frames acotada en bytes"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.queue = deque()  # (header, payload, es_control)
+        self.queued_bytes = 0
+        self.dropped = 0
+
+    def push(self, frame):
+        """Encolar un frame; si se pasa del límite se descartan los más viejos"""
+        self.queue.append(frame)
+        self.queued_bytes += len(frame[0]) + len(frame[1])
+        while self.queued_bytes > self.limit and len(self.queue) > 1:
+            victim = next((f for f in self.queue if not f[2]), None)
+            if victim is None or victim is frame:
+                break
+            self.queue.remove(victim)
+            self.queued_bytes -= len(victim[0]) + len(victim[1])
+            self.dropped += 1
+
+
+class Peer(FrameQueue):
+    """Participante conectado: cola de salida acotada + tarea que la escribe"""
+
+    def __init__(self, writer, limit):
+        super().__init__(limit)
+        self.writer = writer
+        self.wakeup = asyncio.Event()
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        self.task = asyncio.ensure_future(self.run())
+
+    def push(self, frame):
+        super().push(frame)
+        self.wakeup.set()
+
+    async def run(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.queue:
+                    frames, self.queue = self.queue, deque()
+                    self.queued_bytes = 0
+                    for header, payload, _ in frames:
+                        self.writer.write(header)
+                        self.writer.write(payload)
+                    await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+
+class Session:
+    """Una consulta: hasta un participante por rol y stream, más contadores"""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.created = time.monotonic()
+        self.peers = {}     # (stream, role) -> Peer
+        self.pending = {}   # (stream, role) -> FrameQueue esperando a ese participante
+        self.stats = {stream: {"frames": 0, "bytes": 0, "dropped": 0} for stream in STREAMS}
+        self.connections = 0
+
+    def summary(self):
+        return {
+            "session": self.id,
+            "seconds": round(time.monotonic() - self.created, 1),
+            "connections": self.connections,
+            "peers": {f"{stream}/{role}": {"queued_bytes": p.queued_bytes, "dropped": p.dropped}
+                      for (stream, role), p in self.peers.items()},
+            **self.stats,
+        }
+
+
+class MediaServer:
+    """Servidor asyncio que enruta los streams de muchas sesiones"""
+
+    def __init__(self, host="0.0.0.0", port=MEDIA_PORT, max_sessions=1000, authorize=None):
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        # authorize(token, sala, rol) -> bool
+        self.authorize = authorize
+        self.sessions = {}
+
+    def stats(self):
+        """Contadores de todas las sesiones abiertas"""
+        return [s.summary() for s in self.sessions.values()]
+
+    async def _reply(self, writer, message):
+        writer.write(json.dumps(message).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), 10))
+            session_id = str(hello["session"])
+            role, stream = hello["role"], hello["stream"]
+            if role not in ROLES or stream not in STREAMS:
+                raise ValueError
+        except (asyncio.TimeoutError, ValueError, KeyError, TypeError):
+            await self._reply(writer, {"status": "error", "message": "Handshake inválido"})
+            writer.close()
+            return
+        # authorize toca users_db (lock, disco): fuera del loop para no frenar
+        # el reenvío de las demás salas
+        if self.authorize is not None and not await asyncio.get_running_loop().run_in_executor(
+                None, self.authorize, hello.get("token"), session_id, role):
+            await self._reply(writer, {"status": "error", "message": "Sin autorización para esta sala"})
+            writer.close()
+            return
+
+        session = self.sessions.get(session_id)
+        if session is None:
+            if len(self.sessions) >= self.max_sessions:
+                await self._reply(writer, {"status": "error", "message": "Servidor lleno"})
+                writer.close()
+                return
+            session = self.sessions[session_id] = Session(session_id)
+        key = (stream, role)
+        if key in session.peers:
+            await self._reply(writer, {"status": "error", "message": "Rol ya conectado"})
+            writer.close()
+            return
+        # Respuesta y frames que el otro mandó antes de que llegáramos, sin
+        # ceder el loop: así nada se intercala antes de registrar el peer
+        writer.write(json.dumps({"status": "ok"}).encode("utf-8") + b"\n")
+        peer = Peer(writer, QUEUE_LIMITS[stream])
+        pending = session.pending.pop(key, None)
+        if pending is not None:
+            for frame in pending.queue:
+                peer.push(frame)
+        session.peers[key] = peer
+        session.connections += 1
+
+        try:
+            partner = (stream, ROLES[1 - ROLES.index(role)])
+            counters = session.stats[stream]
+            while True:
+                header = await reader.readexactly(MEDIA_HEADER.size)
+                fields = MEDIA_HEADER.unpack(header)
+                if fields[0] != MEDIA_VERSION or fields[MEDIA_LENGTH_FIELD] > MAX_FRAME_SIZE:
+                    # Peer roto o malicioso: no reservar memoria, cortar la conexión
+                    print(f"Invalid frame from {stream}/{role} in {session_id}: closing")
+                    break
+                payload = await reader.readexactly(fields[MEDIA_LENGTH_FIELD])
+                counters["frames"] += 1
+                counters["bytes"] += len(header) + len(payload)
+                self._forward(session, partner, (header, payload, fields[1] == CONTROL))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            session.peers.pop(key, None)
+            session.stats[stream]["dropped"] += peer.dropped
+            peer.task.cancel()
+            writer.close()
+            if not session.peers:
+                del self.sessions[session_id]
+                print("Session closed:", json.dumps(session.summary()))
+
+    def _forward(self, session, partner, frame):
+        # No se espera al destinatario: un participante lento no frena al que envía
+        peer = session.peers.get(partner)
+        if peer is None:
+            pending = session.pending.get(partner)
+            if pending is None:
+                pending = session.pending[partner] = FrameQueue(QUEUE_LIMITS[partner[0]])
+            dropped = pending.dropped
+            pending.push(frame)
+            session.stats[partner[0]]["dropped"] += pending.dropped - dropped
+            return
+        peer.push(frame)
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port, backlog=1024)
+        print(f"Media server on {self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    def start_background(self):
+        """Correr el servidor en un hilo propio (p. ej. junto a server.py)"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+# ============================
+# Lado cliente
+# ============================
+
+class SessionTransport(TcpTransport):
+    """TcpTransport hacia el servidor de media.
+
+    El handshake entre participantes (códec de audio, tamaño de render) va en
+    frames CONTROL con FLAG_HELLO, porque el servidor solo reenvía frames.
+    """
+
+    @classmethod
+    def connect(cls, address, session_id, role, stream, token=None):
+        sock = socket.create_connection(address)
+        hello = {"session": session_id, "role": role, "stream": stream}
+        if token is not None:
+            hello["token"] = token
+        send_hello(sock, hello)
+        answer = recv_hello(sock)
+        if answer.get("status") != "ok":
+            sock.close()
+            raise ConnectionError(answer.get("message", "Rechazado por el servidor de media"))
+        return cls(sock)
+
+    def request(self, message):
+        self.send_hello(message)
+        return self.recv_hello()
+
+    def send_hello(self, message):
+        self.send(CONTROL, 0, json.dumps(message).encode("utf-8"), flags=FLAG_HELLO)
+
+    def recv_hello(self):
+        while True:
+            message = self.recv()
+            if message is None:
+                raise ConnectionError("Conexión cerrada durante el handshake")
+            stream, flags, _seq, _timestamp, payload = message
+            if stream == CONTROL and flags & FLAG_HELLO:
+                return json.loads(bytes(payload))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the multi-session media server.")
+    parser.add_argument("-l", "--listen", default="0.0.0.0", help="IP address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=MEDIA_PORT, help="Port to listen on")
+    parser.add_argument("--max-sessions", type=int, default=1000, help="Maximum concurrent sessions")
+    args = parser.parse_args()
+    MediaServer(args.listen, args.port, args.max_sessions).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# metrics.py
+# Registro de métricas en memoria: contadores, gauges e histogramas de
+# latencia, para /metrics de server.py y las estadísticas de av_call.
+#
+# Registrar o actualizar una métrica no toma locks: inc()/observe() son un
+# par de sumas sobre atributos, así que se pueden llamar por petición o por
+# frame. Con varios hilos escribiendo la misma métrica puede perderse alguna
+# suma muy de vez en cuando; para estadísticas de operación alcanza.
+#
+#   requests = registry.counter("http_requests", route="/login")
+#   requests.inc()
+#   registry.histogram("http_request_ms", route="/login").observe(3.2)
+#   registry.gauge("sessions", fn=lambda: len(table))   # se lee al pedirla
+import threading
+from bisect import bisect_left
+from collections import deque
+
+# Límites (ms) de los buckets por defecto de los histogramas
+LATENCY_BUCKETS_MS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000, 2000, 5000)
+
+
+class Counter:
+    """Valor que solo crece"""
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Valor actual; con fn, se calcula al leerlo (costo cero en el camino caliente)"""
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.fn() if self.fn is not None else self.value
+
+
+class Histogram:
+    """Distribución en buckets fijos, más las últimas window muestras.
+
+    Los buckets acumulan desde el inicio; las muestras recientes (samples)
+    dan percentiles exactos de la ventana, que es lo que interesa en vivo.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS, window=0):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window) if window else None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.samples is not None:
+            self.samples.append(value)
+
+    def percentile(self, fraction):
+        """Percentil de la ventana si la hay, si no el límite del bucket"""
+        if self.samples:
+            values = sorted(self.samples)
+            return values[min(len(values) - 1, int(fraction * len(values)))]
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen > target:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "buckets": {f"<={b}": n for b, n in zip(self.bounds, self.counts) if n},
+        }
+
+
+def metric_key(name, labels):
+    """Nombre con etiquetas: "http_requests{route=/login,status=200}" """
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+class Registry:
+    """Métricas por nombre y etiquetas; crear es idempotente"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}   # (nombre, etiquetas) -> métrica
+
+    def _get(self, factory, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = factory()
+        return metric
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, fn=None, **labels):
+        gauge = self._get(Gauge, name, labels)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS_MS, window=0, **labels):
+        return self._get(lambda: Histogram(buckets, window), name, labels)
+
+    def snapshot(self):
+        """{"nombre{etiquetas}": valor} de todas las métricas"""
+        with self.lock:
+            items = list(self.metrics.items())
+        return {metric_key(name, labels): metric.snapshot() for (name, labels), metric in sorted(items)}
+
+
+# Registro del proceso (server.py); cada llamada de av_call tiene el suyo
+registry = Registry()
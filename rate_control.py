@@ -0,0 +1,108 @@
+# rate_control.py
+# Control de tasa para los senders de video: ajusta calidad JPEG, escala y
+# fps para acercarse a un bitrate objetivo, y marca el ritmo de los frames
+# con un reloj monotónico.
+import time
+import cv2
+
+# Cada cuánto (segundos) se revisan las medidas y se ajustan los parámetros
+ADJUST_INTERVAL = 1.0
+
+
+class RateController:
+    """Adapta la codificación de video al enlace disponible.
+
+    on_sent() recibe cuántos bytes se mandaron, cuánto tardó el envío y
+    cuántos bytes quedan en el buffer de salida del socket. Si el enlace se
+    satura (backlog creciente o envíos que bloquean) o el bitrate estimado
+    supera el objetivo, se baja primero la calidad, luego la resolución y al
+    final los fps; cuando sobra margen se sube en el orden inverso.
+    """
+
+    def __init__(self, target_bps=1_000_000, max_fps=15, min_fps=5,
+                 quality=70, min_quality=30, max_quality=85, min_scale=0.4):
+        self.target_bps = target_bps
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.fps = max_fps
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.scale = 1.0
+        self.min_scale = min_scale
+        # Tamaño de render anunciado por el receptor: no tiene sentido
+        # codificar más píxeles de los que va a mostrar
+        self.max_size = None
+        self.next_frame = time.monotonic()
+        self.window_start = self.next_frame
+        self.window_bytes = 0
+        self.window_frames = 0
+        self.window_send_time = 0.0
+        self.max_backlog = 0
+        self.bitrate = 0
+
+    def pace(self):
+        """Esperar hasta el turno del próximo frame"""
+        now = time.monotonic()
+        if self.next_frame > now:
+            time.sleep(self.next_frame - now)
+        elif now - self.next_frame > 1.0 / self.fps:
+            # Muy atrasados (captura o envío lentos): no mandar ráfagas
+            self.next_frame = now
+        self.next_frame += 1.0 / self.fps
+
+    def prepare(self, frame):
+        """Escalar un frame según la escala actual y el tamaño de render del receptor"""
+        h, w = frame.shape[:2]
+        scale = self.scale
+        if self.max_size:
+            scale *= min(1.0, self.max_size[0] / w, self.max_size[1] / h)
+        if scale < 1.0:
+            frame = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))),
+                               interpolation=cv2.INTER_AREA)
+        return frame
+
+    def encode(self, frame):
+        """Escalar y codificar un frame con los parámetros actuales"""
+        ok, buffer = cv2.imencode('.jpg', self.prepare(frame), [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+        return buffer if ok else None
+
+    def on_sent(self, nbytes, send_seconds, backlog=0):
+        """Registrar un envío y ajustar los parámetros si toca"""
+        self.window_bytes += nbytes
+        self.window_frames += 1
+        self.window_send_time += send_seconds
+        self.max_backlog = max(self.max_backlog, backlog)
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < ADJUST_INTERVAL or not self.window_frames:
+            return
+        self.bitrate = self.window_bytes * 8 / elapsed
+        # Bitrate que tendríamos a los fps actuales si no hubiera cuello
+        frame_bits = self.window_bytes * 8 / self.window_frames
+        expected = frame_bits * self.fps
+        congested = (self.max_backlog > 2 * self.window_bytes / self.window_frames
+                     or self.window_send_time > 0.5 * elapsed)
+        if congested or expected > 1.1 * self.target_bps:
+            self._step_down()
+        elif expected < 0.7 * self.target_bps:
+            self._step_up()
+        self.window_start = now
+        self.window_bytes = self.window_frames = self.max_backlog = 0
+        self.window_send_time = 0.0
+
+    def _step_down(self):
+        if self.quality > self.min_quality:
+            self.quality = max(self.min_quality, self.quality - 10)
+        elif self.scale > self.min_scale:
+            self.scale = max(self.min_scale, round(self.scale * 0.8, 2))
+        elif self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.fps - 2)
+
+    def _step_up(self):
+        if self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps + 2)
+        elif self.scale < 1.0:
+            self.scale = min(1.0, round(self.scale / 0.8, 2))
+        elif self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + 5)
@@ -2,107 +2,561 @@
 # Do not modify this file
 
 import argparse
+import asyncio
+import gzip
+import hashlib
+import hmac
+import ipaddress
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from urllib.parse import parse_qs
+from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from json import dumps
+from json import dumps, loads
+import metrics
+import sessions
 import users
+from events import bus
+from media_server import MediaServer, MEDIA_PORT
+
+# Segundos que una conexión keep-alive puede quedar inactiva antes de cerrarla
+KEEPALIVE_TIMEOUT = 15
+# En el backend con hilos una conexión inactiva ocupa un hilo del pool, así
+# que se espera menos antes de cerrarla (api_client reconecta solo)
+THREADED_KEEPALIVE_TIMEOUT = 5
+# Segundos para recibir el cuerpo y responder una vez llegada la petición
+# (un lote grande de /importusers puede tardar en subir)
+THREADED_REQUEST_TIMEOUT = 60
+
+# Máximo de elementos por página en las rutas paginadas
+MAX_PAGE_SIZE = 200
+
+# Máximo de filas por página en las exportaciones
+MAX_EXPORT_PAGE = 10000
+
+# (método, ruta) que atiende route(); el resto va a las métricas como "other"
+ROUTES = frozenset({
+    ('GET', '/listdoctors'), ('PUT', '/login'), ('PUT', '/logout'), ('POST', '/register'),
+    ('POST', '/addappointment'), ('GET', '/listappointments'), ('POST', '/importusers'),
+    ('POST', '/importappointments'), ('GET', '/exportusers'), ('GET', '/exportappointments'),
+    ('GET', '/freeslots'), ('PUT', '/ready'), ('PUT', '/leave'), ('GET', '/waitingroom'),
+    ('GET', '/events'), ('GET', '/metrics'),
+})
+
+# Rutas cuyo cuerpo es JSONL (una fila por línea) en vez de un formulario
+BULK_ROUTES = ('/importusers', '/importappointments')
+
+# Rutas de operación (importación/exportación masiva): solo se atienden desde
+# la misma máquina o con el token de operador (--operator-token)
+OPERATOR_ROUTES = BULK_ROUTES + ('/exportusers', '/exportappointments')
+operator_token = os.environ.get('TELECONSULTA_OPERATOR_TOKEN')
+
+# Rutas GET cuya respuesta solo cambia cuando cambian los datos
+# (users.data_version): ruta -> (rol de la sesión que las puede pedir,
+# si la respuesta depende del usuario de la sesión)
+CACHED_ROUTES = {'/listdoctors': ('paciente', False), '/freeslots': (None, False),
+                 '/listappointments': ('medico', True)}
+MAX_CACHED_RESPONSES = 4096
+
+# Las respuestas más chicas que esto no se comprimen
+GZIP_MIN_SIZE = 1024
+
+# Segundos que /events retiene la petición si no hay eventos nuevos
+EVENTS_TIMEOUT = 25
+MAX_EVENTS_TIMEOUT = 60
+# Fuera del backend asyncio cada espera ocupa un hilo del pool: la espera se
+# acorta a esto y el cliente vuelve a preguntar antes
+THREADED_EVENTS_TIMEOUT = 5
+
+
+# ============================
+# Rutas (comunes a todos los backends)
+# ============================
+
+def parse_params(query, body):
+    """Unir los parámetros de la query string y del cuerpo"""
+    params = parse_qs(query) if query else {}
+    if body:
+        params.update(parse_qs(body.decode(), strict_parsing=True))
+    return params
+
+
+def parse_rows(body):
+    """Filas de un cuerpo JSONL"""
+    return [loads(line) for line in body.splitlines() if line.strip()]
+
+
+def bearer_token(header):
+    """Token de un header "Authorization: Bearer <token>", o None"""
+    scheme, _, token = (header or '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' and token.strip() else None
+
+
+def session_user(params, role=None):
+    """Usuario dueño del token de la petición; PermissionError si no hay sesión vigente"""
+    user_id = users.sessionUser(params['token'][0], role) if 'token' in params else None
+    if user_id is None:
+        raise PermissionError
+    return user_id
+
+
+def operator_allowed(client, token=None):
+    """True si la petición viene de localhost o trae el token de operador"""
+    if token and operator_token and hmac.compare_digest(token, operator_token):
+        return True
+    try:
+        address = ipaddress.ip_address(client)
+    except (TypeError, ValueError):
+        return False
+    return (getattr(address, 'ipv4_mapped', None) or address).is_loopback
+
+
+def events_args(params):
+    """(doctor_id, after, timeout) de una petición a /events"""
+    doctor_id = session_user(params, 'medico')
+    after = int(params['after'][0]) if 'after' in params else 0
+    timeout = EVENTS_TIMEOUT
+    if 'timeout' in params:
+        timeout = max(0.0, min(float(params['timeout'][0]), MAX_EVENTS_TIMEOUT))
+    return doctor_id, after, timeout
+
+
+def route(method, resource, params):
+    """Ejecutar la función de users que corresponde a la ruta.
+
+    Salvo /register y /login, las rutas de usuario toman el id de la sesión
+    del token (header Authorization: Bearer o parámetro token).
+    """
+    match (method, resource):
+        case ('GET', '/listdoctors'):
+            # Siempre de a una página: sin limit, la más grande permitida
+            limit = max(1, min(int(params['limit'][0]), MAX_PAGE_SIZE)) if 'limit' in params else MAX_PAGE_SIZE
+            after = params['after'][0] if 'after' in params else None
+            return users.doctorsList(session_user(params, 'paciente'), limit, after)
+
+        case ('PUT', '/login'):
+            return users.openSession(params['id'][0], params['password'][0], params['ip'][0])
+
+        case ('PUT', '/logout'):
+            return users.closeSession(params['token'][0])
+
+        case ('POST', '/register'):
+            return users.registerUser(params['name'][0], params['id'][0], params['role'][0], params['password'][0])
+
+        case ('POST', '/addappointment'):
+            return users.addAppointment(session_user(params, 'paciente'), params['doctorid'][0],
+                                        params['date'][0], params['time'][0])
+
+        case ('GET', '/listappointments'):
+            return users.listAppointments(session_user(params, 'medico'))
+
+        case ('POST', '/importusers'):
+            return users.registerUsers(params['rows'])
+
+        case ('POST', '/importappointments'):
+            return users.addAppointments(params['rows'])
+
+        case ('GET', '/exportusers'):
+            limit = max(1, min(int(params['limit'][0]), MAX_EXPORT_PAGE)) if 'limit' in params else MAX_EXPORT_PAGE
+            after = params['after'][0] if 'after' in params else None
+            return users.exportUsers(params['role'][0], limit, after)
+
+        case ('GET', '/exportappointments'):
+            limit = max(1, min(int(params['limit'][0]), MAX_EXPORT_PAGE)) if 'limit' in params else MAX_EXPORT_PAGE
+            after = int(params['after'][0]) if 'after' in params else 0
+            return users.exportAppointments(limit, after)
+
+        case ('GET', '/freeslots'):
+            session_user(params)
+            return users.freeSlots(params['id'][0], params['from'][0], params['to'][0])
+
+        case ('PUT', '/ready'):
+            return users.patientReady(session_user(params, 'paciente'), params['doctorid'][0])
+
+        case ('PUT', '/leave'):
+            return users.patientLeft(session_user(params, 'paciente'), params['doctorid'][0])
+
+        case ('GET', '/waitingroom'):
+            return users.waitingPatients(session_user(params, 'medico'))
+
+        case ('GET', '/events'):
+            # El backend asyncio atiende /events en el loop (AsyncServer.wait_events);
+            # acá la espera ocupa un hilo, así que se acorta
+            doctor_id, after, timeout = events_args(params)
+            return bus.wait(doctor_id, after, min(timeout, THREADED_EVENTS_TIMEOUT))
+
+        case ('GET', '/metrics'):
+            return {"status": "ok", "metrics": metrics.registry.snapshot()}
+    return None
+
+
+def request_params(url, body, token=None):
+    """Parámetros de una petición, con el token del header si vino"""
+    if url.path in BULK_ROUTES:
+        params = parse_params(url.query, b'')
+        params['rows'] = parse_rows(body)
+    else:
+        params = parse_params(url.query, body)
+    if token:
+        params['token'] = [token]
+    return params
+
+
+def dispatch(method, path, body, token=None, client=None):
+    """Procesar una petición y devolver (código HTTP, respuesta)"""
+    url = urlparse(path)
+    if url.path in OPERATOR_ROUTES and not operator_allowed(client, token):
+        return 403, {"status": "error", "message": "Solo para operadores"}
+    try:
+        response = route(method, url.path, request_params(url, body, token))
+    except PermissionError:
+        return 401, {"status": "error", "message": "Sesión inválida o expirada"}
+    except (KeyError, ValueError):
+        return 400, {"status": "error", "message": "Parámetros inválidos"}
+    if response is None:
+        return 404, {"status": "error", "message": "Ruta no encontrada"}
+    return 200, response
+
+
+# ============================
+# Respuestas codificadas y caché
+# ============================
+
+class Encoded:
+    """Respuesta JSON codificada una sola vez, con su ETag y su versión gzip"""
+
+    def __init__(self, response, version=None):
+        self.payload = dumps(response).encode('utf8')
+        self.etag = '"%s"' % hashlib.blake2b(self.payload, digest_size=8).hexdigest()
+        self.version = version
+        self.gzipped = None
+
+    def body(self, accept_gzip):
+        """(bytes, Content-Encoding o None)"""
+        if not accept_gzip or len(self.payload) < GZIP_MIN_SIZE:
+            return self.payload, None
+        if self.gzipped is None:
+            self.gzipped = gzip.compress(self.payload, 6)
+        return self.gzipped, 'gzip'
+
+
+class ResponseCache:
+    """Respuestas de CACHED_ROUTES por ruta y parámetros (LRU).
+
+    Cada entrada guarda la users.data_version con la que se calculó; si la
+    versión cambió, la entrada ya no vale y se vuelve a calcular.
+    """
+
+    def __init__(self, size=MAX_CACHED_RESPONSES):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+response_cache = ResponseCache()
+
+
+def cache_key(resource, params):
+    """Clave de caché de una petición; valida la sesión (PermissionError)"""
+    role, per_user = CACHED_ROUTES[resource]
+    user_id = session_user(params, role)
+    # El token no forma parte de la clave: salvo en las rutas por usuario, la
+    # respuesta es la misma para cualquier sesión con el rol pedido
+    key = tuple(sorted((k, tuple(v)) for k, v in params.items() if k != 'token'))
+    return resource, user_id if per_user else None, key
+
+
+def lookup_cached(method, path, body, token=None):
+    """Respuesta en caché para la petición, o None si hay que ejecutarla.
+
+    No bloquea, así que el backend asyncio la usa directo en el event loop.
+    """
+    url = urlparse(path)
+    if method != 'GET' or url.path not in CACHED_ROUTES:
+        return None
+    try:
+        key = cache_key(url.path, request_params(url, body, token))
+    except (PermissionError, KeyError, ValueError):
+        # dispatch arma la respuesta de error
+        return None
+    return response_cache.get(key, users.data_version)
+
+
+def encoded_response(method, path, body, token=None, client=None):
+    """Ejecutar la petición y codificar la respuesta (guardándola si es cacheable)"""
+    version = users.data_version
+    status, response = dispatch(method, path, body, token, client)
+    encoded = Encoded(response, version)
+    url = urlparse(path)
+    if status == 200 and method == 'GET' and url.path in CACHED_ROUTES:
+        response_cache.put(cache_key(url.path, request_params(url, body, token)), encoded)
+    return status, encoded
+
+
+def reply(status, encoded, if_none_match=None, accept_gzip=False):
+    """(código, headers, cuerpo) listos para escribir"""
+    if status == 200 and if_none_match and encoded.etag in if_none_match:
+        return 304, {"ETag": encoded.etag}, b''
+    payload, encoding = encoded.body(accept_gzip)
+    headers = {"Content-type": "application/json", "Content-Length": str(len(payload)),
+               "ETag": encoded.etag, "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return status, headers, payload
+
+
+# ============================
+# Métricas
+# ============================
+
+def record_request(method, path, status, seconds):
+    """Contar una petición y su latencia por ruta (las rutas desconocidas van juntas)"""
+    resource = urlparse(path).path
+    if (method, resource) in ROUTES:
+        label = f'{method} {resource}'
+    else:
+        # Ruta o método elegidos por el cliente: no pueden crear métricas nuevas
+        resource = label = 'other'
+    metrics.registry.counter('http_requests', route=resource, status=status).inc()
+    metrics.registry.histogram('http_request_ms', route=label).observe(seconds * 1000)
+
+
+def register_gauges():
+    """Gauges del proceso; se calculan solo cuando se pide /metrics"""
+    gauge = metrics.registry.gauge
+    gauge('sessions_active', fn=lambda: len(sessions.table))
+    gauge('sessions_expired', fn=lambda: sessions.table.expired)
+    gauge('event_subscribers', fn=bus.subscribers)
+    gauge('response_cache_entries', fn=lambda: len(response_cache.entries))
+    gauge('response_cache_hits', fn=lambda: response_cache.hits)
+    gauge('response_cache_misses', fn=lambda: response_cache.misses)
+    gauge('data_version', fn=lambda: users.data_version)
+
+
+def respond(method, path, body, token=None, if_none_match=None, accept_gzip=False, client=None):
+    cached = lookup_cached(method, path, body, token)
+    status, encoded = (200, cached) if cached is not None else encoded_response(method, path, body, token, client)
+    return reply(status, encoded, if_none_match, accept_gzip)
+
+
+# ============================
+# Backend con hilos (http.server)
+# ============================
 
 class Server(HTTPServer):
+    # Cola de conexiones pendientes amplia para los picos de login
+    request_queue_size = 1024
+
     def __init__(self, address, request_handler):
         super().__init__(address, request_handler)
 
 
+class ThreadPoolServer(Server):
+    """HTTPServer que atiende cada conexión en un pool de hilos fijo"""
+
+    def __init__(self, address, request_handler, workers=32):
+        super().__init__(address, request_handler)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
 class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = THREADED_KEEPALIVE_TIMEOUT
+    # Cabeceras y cuerpo van en escrituras separadas: sin TCP_NODELAY, Nagle
+    # y el ACK retardado del cliente suman ~40 ms a cada respuesta keep-alive
+    disable_nagle_algorithm = True
+
     def __init__(self, request, client_address, server_class):
         self.server_class = server_class
         super().__init__(request, client_address, server_class)
 
-    def do_GET(self):
-        resource=urlparse(self.path).path
-        match resource:                    
-            
-
-            case '/listdoctors':
-                content_len = int(self.headers.get('Content-Length'))
-                post_body = self.rfile.read(content_len)
-                params_dict=parse_qs(post_body.decode(), strict_parsing=True)
-                response=dumps(users.doctorsList(params_dict['id'][0]))
-
-                
-        self.send_response(200)
-        self.send_header("Content-type", "application/json")
-        self.send_header("Content-Length", str(len(response)))
+    def handle_request(self, method):
+        start = time.perf_counter()
+        # self.timeout es la espera entre peticiones; para el cuerpo y la
+        # respuesta hay más margen
+        self.connection.settimeout(THREADED_REQUEST_TIMEOUT)
+        content_len = int(self.headers.get('Content-Length') or 0)
+        post_body = self.rfile.read(content_len) if content_len else b''
+        token = bearer_token(self.headers.get('Authorization'))
+        status, headers, payload = respond(method, self.path, post_body, token,
+                                           self.headers.get('If-None-Match'),
+                                           'gzip' in (self.headers.get('Accept-Encoding') or ''),
+                                           self.client_address[0])
+        record_request(method, self.path, status, time.perf_counter() - start)
+
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
         self.end_headers()
-        self.wfile.write(str(response).encode('utf8'))
+        self.wfile.write(payload)
         self.wfile.flush()
+        self.connection.settimeout(self.timeout)
 
-
+    def do_GET(self):
+        self.handle_request('GET')
 
     def do_PUT(self):
-        resource=urlparse(self.path).path
-        print(resource)
-        match resource:
-           
-            case "/login":
-                content_len = int(self.headers.get('Content-Length'))
-                post_body = self.rfile.read(content_len)
-                params_dict=parse_qs(post_body.decode(), strict_parsing=True)
-                response=users.openSession(params_dict['id'][0],params_dict['password'][0],params_dict['ip'][0])
-            
-            case "/logout":
-                content_len = int(self.headers.get('Content-Length'))
-                post_body = self.rfile.read(content_len)
-                params_dict=parse_qs(post_body.decode(), strict_parsing=True)
-                response=users.closeSession(params_dict['id'][0])
-        
-        
-        self.send_response(200)
-        self.send_header("Content-type", "application/json")
-        self.send_header("Content-Length", str(len(response)))
-        self.end_headers()
-        self.wfile.write(str(response).encode('utf8'))
-        self.wfile.flush()
+        self.handle_request('PUT')
 
+    def do_POST(self):
+        self.handle_request('POST')
 
 
+# ============================
+# Backend asyncio
+# ============================
+
+class AsyncServer:
+    """Servidor HTTP/1.1 sobre asyncio con las mismas rutas que RequestHandler.
+
+    Las conexiones inactivas solo cuestan una corrutina; las llamadas a users
+    (que pueden escribir en disco) se ejecutan en un pool de hilos para no
+    bloquear el event loop. /events espera en el propio loop, sin hilos, así
+    que aguanta miles de médicos suscritos a la vez.
+    """
+
+    def __init__(self, address, workers=32):
+        self.address = address
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def handle_client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        client = (writer.get_extra_info('peername') or (None,))[0]
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                if not request_line.strip():
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                content_len = int(headers.get('content-length') or 0)
+                post_body = await reader.readexactly(content_len) if content_len else b''
+                start = time.perf_counter()
+
+                token = bearer_token(headers.get('authorization'))
+                # Los aciertos de caché se sirven sin pasar por el pool de hilos
+                cached = lookup_cached(method, path, post_body, token)
+                if cached is not None:
+                    status, encoded = 200, cached
+                elif method == 'GET' and path.startswith('/events'):
+                    status, response = await self.wait_events(path, token)
+                    encoded = Encoded(response)
+                else:
+                    status, encoded = await loop.run_in_executor(
+                        self.executor, encoded_response, method, path, post_body, token, client)
+                status, reply_headers, payload = reply(status, encoded, headers.get('if-none-match'),
+                                                       'gzip' in headers.get('accept-encoding', ''))
+                record_request(method, path, status, time.perf_counter() - start)
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                reply_headers["Connection"] = 'keep-alive' if keep_alive else 'close'
+                head = f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n" + "".join(
+                    f"{key}: {value}\r\n" for key, value in reply_headers.items()) + "\r\n"
+                writer.write(head.encode('latin-1') + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def wait_events(self, path, token=None):
+        url = urlparse(path)
+        if url.path != '/events':
+            return 404, {"status": "error", "message": "Ruta no encontrada"}
+        try:
+            doctor_id, after, timeout = events_args(request_params(url, b'', token))
+        except PermissionError:
+            return 401, {"status": "error", "message": "Sesión inválida o expirada"}
+        except (KeyError, ValueError):
+            return 400, {"status": "error", "message": "Parámetros inválidos"}
+        return 200, await bus.wait_async(doctor_id, after, timeout)
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_client, self.address[0], self.address[1], backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.executor.shutdown(wait=False)
 
-    def do_POST(self):
-        resource=urlparse(self.path).path
-        print(resource)
-        match resource:
-            case "/register":
-                content_len = int(self.headers.get('Content-Length'))
-                post_body = self.rfile.read(content_len)
-                params_dict=parse_qs(post_body.decode(), strict_parsing=True)
-                response=users.registerUser(params_dict['name'][0],params_dict['id'][0],params_dict['role'][0],params_dict['password'][0])
-
-            case "/addappointment":
-                content_len = int(self.headers.get('Content-Length'))
-                post_body = self.rfile.read(content_len)
-                params_dict=parse_qs(post_body.decode(), strict_parsing=True)
-                response=users.addAppointment(params_dict['id'][0],params_dict['doctorid'][0],params_dict['date'][0],params_dict['time'][0])
-
-
-
-        
-        
-        
-        self.send_response(200)
-        self.send_header("Content-type", "application/json")
-        self.send_header("Content-Length", str(len(response)))
-        self.end_headers()
-        self.wfile.write(str(response).encode('utf8'))
-        self.wfile.flush()
 
-def start_server(addr, port, server_class=Server, handler_class=RequestHandler):
+def start_server(addr, port, server_class=None, handler_class=RequestHandler, backend="asyncio", workers=32):
+    """Cargar los datos y atender peticiones con el backend elegido.
+
+    server_class y handler_class solo valen para "simple" y "threaded" (por
+    defecto Server y ThreadPoolServer); "asyncio" usa AsyncServer. En
+    "threaded" cada conexión abierta ocupa un hilo del pool, así que el
+    keep-alive inactivo se corta a THREADED_KEEPALIVE_TIMEOUT segundos y
+    /events espera como mucho THREADED_EVENTS_TIMEOUT: el long-poll completo
+    es del backend asyncio.
+    """
     server_address = (addr, port)
-    http_server = server_class(server_address, handler_class)
-    print(f"Starting server on {addr}:{port}")
+    print(f"Loaded {users.loadUsers()} users")
+    users.syncAppointments()
+    register_gauges()
+    match backend:
+        case "asyncio":
+            http_server = AsyncServer(server_address, workers=workers)
+        case "threaded":
+            http_server = (server_class or ThreadPoolServer)(server_address, handler_class, workers=workers)
+        case _:
+            http_server = (server_class or Server)(server_address, handler_class)
+    print(f"Starting server on {addr}:{port} ({backend}, {workers} workers)")
     http_server.serve_forever()
 
 
 def main():
+    global operator_token
     parser = argparse.ArgumentParser(description="Run a simple HTTP server.")
     parser.add_argument(
         "-l",
@@ -117,8 +571,47 @@ def main():
         default=80,
         help="Specify the port which server should listen",
     )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=["simple", "threaded", "asyncio"],
+        default="asyncio",
+        help="Concurrency backend: single thread, thread pool or asyncio event loop",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=32,
+        help="Number of worker threads for the threaded and asyncio backends",
+    )
+    parser.add_argument(
+        "-r",
+        "--relay-port",
+        type=int,
+        default=MEDIA_PORT,
+        help="Port for the media relay that runs alongside the API (0 disables it)",
+    )
+    parser.add_argument(
+        "--operator-token",
+        default=operator_token,
+        help="Token that allows the bulk import/export routes from other hosts "
+             "(default: $TELECONSULTA_OPERATOR_TOKEN; without it they only answer localhost)",
+    )
+    parser.add_argument(
+        "--slot-minutes",
+        type=int,
+        default=users.SLOT_MINUTES,
+        help="Length of an appointment slot in minutes",
+    )
     args = parser.parse_args()
-    start_server(addr=args.listen, port=args.port)
+    operator_token = args.operator_token
+    users.SLOT_MINUTES = args.slot_minutes
+    if args.relay_port:
+        relay = MediaServer(args.listen, args.relay_port, authorize=users.roomAccess)
+        relay.start_background()
+        metrics.registry.gauge('relay_sessions', fn=lambda: len(relay.sessions))
+    start_server(addr=args.listen, port=args.port, backend=args.backend, workers=args.workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+# sessions.py
+# Sesiones por token y contraseñas con hash.
+#
+# Al iniciar sesión se entrega un token opaco; las rutas lo buscan en un
+# diccionario (O(1)) en vez de volver a verificar la contraseña, que es
+# deliberadamente lenta. Cada uso renueva el vencimiento (TTL deslizante) y
+# una rueda de tiempo expulsa los tokens vencidos sin recorrer la tabla.
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+SESSION_TTL = 30 * 60
+WHEEL_TICK = 1.0
+TOKEN_BYTES = 24
+
+HASH_PREFIX = "pbkdf2_sha256"
+HASH_ITERATIONS = 100_000
+
+
+# ============================
+# Contraseñas
+# ============================
+
+def hash_password(password, iterations=HASH_ITERATIONS):
+    """Hash con sal: "pbkdf2_sha256$iteraciones$sal$hash" """
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{HASH_PREFIX}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def is_hashed(stored):
+    return stored.startswith(HASH_PREFIX + "$")
+
+
+def check_password(stored, password):
+    """Comparar password con lo guardado (hash o texto plano de datos viejos)"""
+    if not is_hashed(stored):
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+    try:
+        _, iterations, salt, digest = stored.split("$")
+        expected = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(expected.hex(), digest)
+
+
+# ============================
+# Tabla de sesiones
+# ============================
+
+class SessionTable:
+    """token -> {"user", "role", "ip", "expires"} con vencimiento deslizante.
+
+    La rueda tiene un bucket por tick; cada token está en el bucket de su
+    vencimiento. get() solo actualiza "expires": el barrido, al llegar al
+    bucket, expulsa los tokens vencidos y reubica los que se renovaron.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, tick=WHEEL_TICK):
+        self.ttl = ttl
+        self.tick = tick
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.wheel = [set() for _ in range(int(ttl / tick) + 2)]
+        self.position = int(time.monotonic() / tick)
+        self.expired = 0
+        self.sweeper = None
+
+    def _bucket(self, expires):
+        return self.wheel[int(expires / self.tick) % len(self.wheel)]
+
+    def create(self, user_id, role, ip):
+        """Abrir una sesión y devolver su token"""
+        token = secrets.token_urlsafe(TOKEN_BYTES)
+        entry = {"user": user_id, "role": role, "ip": ip, "expires": time.monotonic() + self.ttl}
+        with self.lock:
+            self.entries[token] = entry
+            self._bucket(entry["expires"]).add(token)
+            if self.sweeper is None:
+                self.sweeper = threading.Thread(target=self._sweep_loop, daemon=True)
+                self.sweeper.start()
+        return token
+
+    def get(self, token):
+        """Sesión del token (renovando su vencimiento), o None"""
+        entry = self.entries.get(token)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if entry["expires"] <= now:
+            return None
+        entry["expires"] = now + self.ttl
+        return entry
+
+    def remove(self, token):
+        with self.lock:
+            return self.entries.pop(token, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def sweep(self, now=None):
+        """Avanzar la rueda hasta now; devuelve cuántos tokens expulsó"""
+        now = time.monotonic() if now is None else now
+        target = int(now / self.tick)
+        removed = 0
+        with self.lock:
+            # Si el barrido se atrasó más de una vuelta basta con una vuelta
+            self.position = max(self.position, target - len(self.wheel))
+            while self.position < target:
+                self.position += 1
+                index = self.position % len(self.wheel)
+                bucket = self.wheel[index]
+                if not bucket:
+                    continue
+                self.wheel[index] = set()
+                for token in bucket:
+                    entry = self.entries.get(token)
+                    if entry is None:
+                        continue
+                    if int(entry["expires"] / self.tick) <= self.position:
+                        del self.entries[token]
+                        removed += 1
+                    else:
+                        self._bucket(entry["expires"]).add(token)
+            self.expired += removed
+        return removed
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.tick)
+            self.sweep()
+
+
+# Tabla compartida por users.py y server.py
+table = SessionTable()
@@ -0,0 +1,145 @@
+# storage.py
+# Persistencia de users_db: log de solo-anexar + snapshot binario.
+#
+# Cada cambio (registro, cambio de contraseña) se añade como una línea JSON
+# a log_file. Cada COMPACT_EVERY operaciones el diccionario completo se vuelca
+# con marshal a snapshot_file y el log se vacía. Al arrancar se carga el
+# snapshot y se reproducen las operaciones del log encima.
+import json
+import marshal
+import os
+from itertools import repeat
+
+snapshot_file = "users_db.snapshot"
+log_file = "users_db.log"
+
+# Archivos antiguos que se importan una sola vez si no hay snapshot ni log
+legacy_txt = "users.txt"
+legacy_json = ["users.json", "users_backup.json"]
+legacy_roles = {"patient": "paciente", "doctor": "medico"}
+
+SNAPSHOT_VERSION = 1
+COMPACT_EVERY = 10000
+# os.fsync después de cada operación (más lento, sobrevive a cortes de luz)
+FSYNC = False
+
+_log = None
+_log_entries = 0
+
+
+def load(db):
+    """Cargar snapshot + log en db y dejar el log abierto para anexar"""
+    global _log, _log_entries
+    db.clear()
+    fresh = not os.path.exists(snapshot_file) and not os.path.exists(log_file)
+    if os.path.exists(snapshot_file):
+        with open(snapshot_file, "rb") as f:
+            version, fields, ids, columns = marshal.loads(f.read())
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Versión de snapshot no soportada: {version}")
+        if "session" in fields:
+            # Columna de snapshots viejos, ya no se usa
+            column = fields.index("session")
+            del fields[column], columns[column]
+        db.update(zip(ids, map(dict, map(zip, repeat(fields), zip(*columns)))))
+    _log_entries = replay(db)
+    _log = open(log_file, "a", encoding="utf-8")
+    if fresh:
+        importLegacy(db)
+        compact(db)
+    return len(db)
+
+
+def replay(db):
+    """Aplicar las operaciones del log sobre db"""
+    count = 0
+    if not os.path.exists(log_file):
+        return count
+    with open(log_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                op = json.loads(line)
+            except ValueError:
+                # Última línea cortada por una caída: se descarta
+                break
+            apply(db, op)
+            count += 1
+    return count
+
+
+def apply(db, op):
+    """Aplicar una operación del log
+
+    Los logs viejos pueden traer operaciones "session" y usuarios con campo
+    "session": ya no se usan y se descartan.
+    """
+    match op["op"]:
+        case "register":
+            op["user"].pop("session", None)
+            db[op["id"]] = op["user"]
+        case "password":
+            if op["id"] in db:
+                db[op["id"]]["password"] = op["password"]
+
+
+def append(db, op):
+    """Anexar una operación al log (y compactar si el log creció mucho)"""
+    extend(db, [op])
+
+
+def extend(db, ops):
+    """Anexar varias operaciones al log con una sola escritura"""
+    global _log_entries
+    if _log is None or not ops:
+        return
+    _log.write("".join([json.dumps(op, separators=(",", ":")) + "\n" for op in ops]))
+    _log.flush()
+    if FSYNC:
+        os.fsync(_log.fileno())
+    _log_entries += len(ops)
+    if _log_entries >= COMPACT_EVERY:
+        compact(db)
+
+
+def compact(db):
+    """Escribir un snapshot nuevo y vaciar el log"""
+    global _log, _log_entries
+    # Se guarda por columnas: más compacto y más rápido de cargar que
+    # un diccionario por usuario
+    fields = sorted({k for u in db.values() for k in u})
+    columns = [[u.get(k, "") for u in db.values()] for k in fields]
+    tmp = snapshot_file + ".tmp"
+    with open(tmp, "wb") as f:
+        marshal.dump((SNAPSHOT_VERSION, fields, list(db), columns), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, snapshot_file)
+    # Si se cae aquí, reproducir el log otra vez es inofensivo
+    if _log is not None:
+        _log.close()
+    _log = open(log_file, "w", encoding="utf-8")
+    _log_entries = 0
+
+
+def importLegacy(db):
+    """Importar users.txt / users.json / users_backup.json"""
+    if os.path.exists(legacy_txt):
+        with open(legacy_txt, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = [p.strip() for p in line.split(",")]
+                if len(parts) < 4 or not parts[1]:
+                    continue
+                name, uid, role, password = parts[:4]
+                db.setdefault(uid, {"name": name, "role": legacy_roles.get(role, role),
+                                    "password": password})
+    for path in legacy_json:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        for u in entries:
+            name = u.get("username", "").strip()
+            if not name:
+                continue
+            db.setdefault(name, {"name": name, "role": legacy_roles.get(u.get("role"), u.get("role")),
+                                 "password": u.get("password", "")})
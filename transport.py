@@ -0,0 +1,243 @@
+# transport.py
+# Transportes de media para av_call: TCP (confiable, en orden) y UDP
+# (datagramas, se descartan los frames tardíos o incompletos).
+#
+# Ambos tienen la misma interfaz:
+#   send(stream, seq, payload, timestamp=None, flags=0)
+#   recv() -> (stream, flags, seq, timestamp, payload) o None si se cerró
+#   request(message) -> respuesta      (handshake, lado cliente)
+#   recv_hello() / send_hello(message)  (handshake, lado servidor)
+#   send_control(message)               (mensaje de control durante la llamada)
+import fcntl
+import itertools
+import json
+import socket
+import struct
+import termios
+import threading
+import time
+from framing import (MediaReader, send_media, send_hello, recv_hello, timestamp_us,
+                     MEDIA_HEADER, MEDIA_VERSION, CONTROL, FLAG_HELLO)
+
+
+def socket_backlog(sock):
+    """Bytes en el buffer de salida del socket aún no enviados (Linux), o 0"""
+    try:
+        return struct.unpack('i', fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b'\0' * 4))[0]
+    except (OSError, AttributeError):
+        return 0
+
+
+class TcpTransport:
+    """Frames de media sobre una conexión TCP ya abierta"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = MediaReader(sock)
+        # Video y mensajes de control pueden enviarse desde hilos distintos
+        self.send_lock = threading.Lock()
+        self.control_seq = itertools.count(1)
+        # Bytes en la red (cabeceras incluidas)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def send_control(self, message):
+        """Mandar un dict JSON por CONTROL con el siguiente seq (lo usan varios hilos)"""
+        return self.send(CONTROL, next(self.control_seq), json.dumps(message).encode("utf-8"))
+
+    def send(self, stream, seq, payload, timestamp=None, flags=0):
+        with self.send_lock:
+            sent = send_media(self.sock, stream, seq, payload, timestamp, flags)
+            self.bytes_sent += sent
+            return sent
+
+    def recv(self):
+        message = self.reader.read_media()
+        if message is not None:
+            self.bytes_received += MEDIA_HEADER.size + len(message[4])
+        return message
+
+    def backlog(self):
+        return socket_backlog(self.sock)
+
+    def request(self, message):
+        send_hello(self.sock, message)
+        return recv_hello(self.sock)
+
+    def recv_hello(self):
+        return recv_hello(self.sock)
+
+    def send_hello(self, message):
+        send_hello(self.sock, message)
+
+    def close(self):
+        self.sock.close()
+
+
+# ============================
+# UDP
+# ============================
+# Cada frame se parte en fragmentos que caben en un datagrama. Cabecera:
+# versión, stream, flags, seq, timestamp, índice y total de fragmentos.
+FRAGMENT_HEADER = struct.Struct('!BBHIQHH')
+MAX_FRAGMENT = 1200
+MAX_DATAGRAM = FRAGMENT_HEADER.size + MAX_FRAGMENT
+
+HELLO_RETRIES = 10
+HELLO_TIMEOUT = 0.5
+
+
+def _newer(seq, last):
+    """True si seq es posterior a last (con vuelta de los 32 bits)"""
+    return 0 < ((seq - last) & 0xFFFFFFFF) < 0x80000000
+
+
+class UdpTransport:
+    """Frames de media sobre UDP con fragmentación y reensamblado por seq.
+
+    El receptor entrega solo frames completos y en orden creciente: un frame
+    que llega después de uno más nuevo, o que no se completa en max_age
+    segundos, se descarta en vez de esperarlo. Si no se conoce peer (lado
+    servidor) se toma la dirección del primer datagrama recibido.
+    """
+
+    def __init__(self, sock, peer=None, max_age=0.2):
+        self.sock = sock
+        self.peer = peer
+        self.max_age = max_age
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.buf = bytearray(MAX_DATAGRAM)
+        self.view = memoryview(self.buf)
+        self.pending = {}     # (stream, seq) -> [flags, timestamp, partes, faltan, llegada]
+        self.last_seq = {}    # stream -> último seq entregado
+        self.last_answer = None
+        # El receptor descarta los CONTROL con seq no creciente: todos los
+        # que manda este lado salen de un mismo contador
+        self.control_seq = itertools.count(1)
+        self.dropped = 0      # frames descartados (tardíos o incompletos)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def send_control(self, message):
+        """Mandar un dict JSON por CONTROL con el siguiente seq (lo usan varios hilos)"""
+        return self.send(CONTROL, next(self.control_seq), json.dumps(message).encode("utf-8"))
+
+    def send(self, stream, seq, payload, timestamp=None, flags=0):
+        if self.peer is None:
+            return 0
+        if timestamp is None:
+            timestamp = timestamp_us()
+        payload = memoryview(payload).cast('B')
+        count = max(1, -(-len(payload) // MAX_FRAGMENT))
+        seq &= 0xFFFFFFFF
+        for index in range(count):
+            header = FRAGMENT_HEADER.pack(MEDIA_VERSION, stream, flags, seq, timestamp, index, count)
+            part = payload[index * MAX_FRAGMENT:(index + 1) * MAX_FRAGMENT]
+            self.sock.sendmsg([header, part], [], 0, self.peer)
+        sent = len(payload) + count * FRAGMENT_HEADER.size
+        self.bytes_sent += sent
+        return sent
+
+    def backlog(self):
+        # UDP no acumula: lo que no cabe se pierde
+        return 0
+
+    def _recv_datagram(self):
+        """Leer un datagrama del peer: (campos, datos)"""
+        while True:
+            n, addr = self.sock.recvfrom_into(self.buf)
+            if self.peer is None:
+                self.peer = addr
+            elif addr != self.peer:
+                continue
+            if n < FRAGMENT_HEADER.size:
+                continue
+            self.bytes_received += n
+            fields = FRAGMENT_HEADER.unpack_from(self.buf)
+            if fields[0] != MEDIA_VERSION:
+                continue
+            return fields, bytes(self.view[FRAGMENT_HEADER.size:n])
+
+    def recv(self):
+        while True:
+            try:
+                (_, stream, flags, seq, timestamp, index, count), data = self._recv_datagram()
+            except OSError:
+                return None
+            if stream == CONTROL and flags & FLAG_HELLO:
+                # El cliente repite el hello si no le llegó la respuesta
+                if self.last_answer is not None:
+                    self._send_hello_datagram(self.last_answer)
+                continue
+            last = self.last_seq.get(stream)
+            if last is not None and not _newer(seq, last):
+                self.dropped += 1
+                continue
+            if count == 1:
+                return self._deliver(stream, flags, seq, timestamp, data)
+            key = (stream, seq)
+            entry = self.pending.get(key)
+            if entry is None:
+                entry = self.pending[key] = [flags, timestamp, [None] * count, count, time.monotonic()]
+            parts = entry[2]
+            # Un fragmento que no coincide con el total del primero está roto
+            if count != len(parts) or index >= len(parts):
+                self.dropped += 1
+                continue
+            if parts[index] is None:
+                parts[index] = data
+                entry[3] -= 1
+            if entry[3] == 0:
+                del self.pending[key]
+                return self._deliver(stream, flags, seq, timestamp, b''.join(parts))
+            self._expire()
+
+    def _deliver(self, stream, flags, seq, timestamp, payload):
+        self.last_seq[stream] = seq
+        # Los frames incompletos anteriores ya no sirven
+        for key in [k for k in self.pending if k[0] == stream and not _newer(k[1], seq)]:
+            del self.pending[key]
+            self.dropped += 1
+        return stream, flags, seq, timestamp, payload
+
+    def _expire(self):
+        limit = time.monotonic() - self.max_age
+        for key in [k for k, e in self.pending.items() if e[4] < limit]:
+            del self.pending[key]
+            self.dropped += 1
+
+    # Handshake: mensajes JSON en datagramas CONTROL
+
+    def _send_hello_datagram(self, message):
+        data = json.dumps(message, separators=(",", ":")).encode("utf-8")
+        self.sock.sendto(FRAGMENT_HEADER.pack(MEDIA_VERSION, CONTROL, FLAG_HELLO, 0, timestamp_us(), 0, 1) + data, self.peer)
+
+    def request(self, message):
+        timeout = self.sock.gettimeout()
+        self.sock.settimeout(HELLO_TIMEOUT)
+        try:
+            for _ in range(HELLO_RETRIES):
+                self._send_hello_datagram(message)
+                try:
+                    while True:
+                        fields, data = self._recv_datagram()
+                        if fields[1] == CONTROL and fields[2] & FLAG_HELLO:
+                            return json.loads(data)
+                except socket.timeout:
+                    continue
+        finally:
+            self.sock.settimeout(timeout)
+        raise ConnectionError("Sin respuesta del peer UDP")
+
+    def recv_hello(self):
+        while True:
+            fields, data = self._recv_datagram()
+            if fields[1] == CONTROL and fields[2] & FLAG_HELLO:
+                return json.loads(data)
+
+    def send_hello(self, message):
+        self.last_answer = message
+        self._send_hello_datagram(message)
+
+    def close(self):
+        self.sock.close()
@@ -1,87 +1,533 @@
 # users.py
-from datetime import datetime
+from bisect import bisect_left, insort
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as Date, datetime, timedelta
+from functools import lru_cache
 import os
+import threading
+import storage
+import sessions
+from events import bus
 import users
 print("Python está usando este users.py:", users.__file__)
 
 # ============================
 # Base de datos simple en memoria
 # ============================
-# users_db: id -> {name, password, role, session}
+# users_db: id -> {name, password (hash), role}
 users_db = {}
 
+# Lock que protege users_db y el archivo de citas cuando el servidor
+# atiende peticiones en varios hilos a la vez
+db_lock = threading.RLock()
+
+# Índice secundario por rol: role -> lista de ids en orden de registro,
+# y id -> posición en esa lista (para paginar con un cursor "after")
+users_by_role = {}
+role_position = {}
+
 # Archivo donde se guardan las citas
 appointments_file = "appointments.txt"
 
+# Índices en memoria de las citas: doctor_id / patient_id -> lista de citas.
+# Se construyen una vez y luego solo se leen las líneas añadidas al archivo
+# a partir de appointments_offset.
+appointments_by_doctor = {}
+appointments_by_patient = {}
+appointments_offset = 0
+
+# Índice de horarios: (doctor_id, fecha) -> minutos de inicio ordenados.
+# Todas las citas duran SLOT_MINUTES, así que dos se pisan si sus inicios
+# están a menos de SLOT_MINUTES; con bisect eso se revisa en O(log n).
+appointment_slots = {}
+SLOT_MINUTES = 30
+# Jornada (minutos desde medianoche) en la que se ofrecen horarios libres
+WORKDAY_START = 8 * 60
+WORKDAY_END = 18 * 60
+# Máximo de días por consulta de horarios libres
+MAX_SLOT_DAYS = 31
+
+# Versión de los datos: sube con cada usuario o cita que entra a los índices.
+# server.py la usa para saber si una respuesta guardada sigue valiendo.
+data_version = 0
+
+# Sala de espera: doctor_id -> {patient_id: {"since": hora de llegada, "room": sala}}
+waiting_room = {}
+
+# Roles válidos y errores por fila que se devuelven en una importación masiva
+ROLES = ("paciente", "medico")
+MAX_IMPORT_ERRORS = 100
+
 # ============================
 # Funciones de usuarios
 # ============================
 
+def loadUsers():
+    """Cargar users_db desde disco (snapshot + log)"""
+    with db_lock:
+        count = storage.load(users_db)
+        users_by_role.clear()
+        role_position.clear()
+        for uid, u in users_db.items():
+            indexRole(uid, u["role"])
+        return count
+
+def indexRole(user_id, role):
+    """Agregar un usuario al índice por rol"""
+    global data_version
+    data_version += 1
+    ids = users_by_role.setdefault(role, [])
+    role_position[user_id] = len(ids)
+    ids.append(user_id)
+
+def storedPassword(password):
+    """Lo que se guarda como contraseña: el hash (o el hash ya calculado)"""
+    return password if sessions.is_hashed(password) else sessions.hash_password(password)
+
 def registerUser(name, user_id, role, password):
     """Registrar un nuevo usuario"""
-    if user_id in users_db:
-        return {"status": "error", "message": "ID ya registrado"}
-    users_db[user_id] = {"name": name, "role": role, "password": password, "session": ""}
-    return {"status": "ok", "message": "Usuario registrado"}
+    # El hash es lento a propósito: se calcula fuera del lock
+    password = storedPassword(password)
+    with db_lock:
+        if user_id in users_db:
+            return {"status": "error", "message": "ID ya registrado"}
+        users_db[user_id] = {"name": name, "role": role, "password": password}
+        indexRole(user_id, role)
+        storage.append(users_db, {"op": "register", "id": user_id, "user": users_db[user_id]})
+        return {"status": "ok", "message": "Usuario registrado"}
 
 def openSession(user_id, password, ip):
-    """Iniciar sesión de un usuario"""
-    u = users_db.get(user_id)
-    if not u:
-        return {"status": "error", "message": "Usuario no encontrado"}
-    if u["password"] != password:
+    """Iniciar sesión de un usuario y devolver su token"""
+    with db_lock:
+        u = users_db.get(user_id)
+        if not u:
+            return {"status": "error", "message": "Usuario no encontrado"}
+        stored, role = u["password"], u["role"]
+    if not sessions.check_password(stored, password):
         return {"status": "error", "message": "Contraseña incorrecta"}
-    u["session"] = ip
-    return {"status": "ok", "message": "Sesión iniciada", "role": u["role"]}
-
-def closeSession(user_id):
-    """Cerrar sesión de un usuario"""
-    u = users_db.get(user_id)
-    if not u:
-        return {"status": "error", "message": "Usuario no encontrado"}
-    u["session"] = ""
+    if not sessions.is_hashed(stored):
+        # Contraseña de los archivos viejos en texto plano: guardar el hash
+        hashed = sessions.hash_password(password)
+        with db_lock:
+            u["password"] = hashed
+            storage.append(users_db, {"op": "password", "id": user_id, "password": hashed})
+    token = sessions.table.create(user_id, role, ip)
+    return {"status": "ok", "message": "Sesión iniciada", "role": role,
+            "token": token, "expires_in": sessions.table.ttl}
+
+def closeSession(token):
+    """Cerrar la sesión de un token"""
+    if sessions.table.remove(token) is None:
+        return {"status": "error", "message": "Sesión no encontrada"}
     return {"status": "ok", "message": "Sesión cerrada"}
 
-def doctorsList(user_id):
-    """Listar todos los doctores para un paciente"""
-    user = users_db.get(user_id)
-    if not user or user["role"] != "paciente":
-        return {"status": "error", "message": "Acceso denegado"}
-    doctors = [{"id": uid, "name": u["name"]} for uid, u in users_db.items() if u["role"]=="medico"]
-    return {"status": "ok", "doctors": doctors}
+def sessionUser(token, role=None):
+    """Id del usuario de una sesión vigente (y del rol pedido), o None"""
+    entry = sessions.table.get(token)
+    if entry is None or (role is not None and entry["role"] != role):
+        return None
+    return entry["user"]
+
+def doctorsList(user_id, limit=None, after=None):
+    """Listar los doctores para un paciente.
+
+    Con limit se devuelve una sola página; "next" es el cursor (id del último
+    doctor) que se pasa como after para pedir la siguiente.
+    """
+    with db_lock:
+        user = users_db.get(user_id)
+        if not user or user["role"] != "paciente":
+            return {"status": "error", "message": "Acceso denegado"}
+        page = rolePage("medico", limit, after)
+        if page is None:
+            return {"status": "error", "message": "Cursor inválido"}
+        ids, next_cursor = page
+        doctors = [{"id": uid, "name": users_db[uid]["name"]} for uid in ids]
+        return {"status": "ok", "doctors": doctors, "next": next_cursor}
+
+def rolePage(role, limit=None, after=None):
+    """(ids, cursor siguiente) de una página del índice por rol, o None si el cursor no vale"""
+    ids = users_by_role.get(role, [])
+    start = 0
+    if after is not None:
+        if users_db.get(after, {}).get("role") != role:
+            return None
+        start = role_position[after] + 1
+    end = len(ids) if limit is None else min(start + limit, len(ids))
+    return ids[start:end], ids[end - 1] if end < len(ids) else None
 
 def addAppointment(patient_id, doctor_id, date, time):
     """Agregar una cita"""
-    if doctor_id not in users_db or users_db[doctor_id]["role"] != "medico":
-        return {"status": "error", "message": "Doctor no encontrado"}
-    if patient_id not in users_db or users_db[patient_id]["role"] != "paciente":
-        return {"status": "error", "message": "Paciente no encontrado"}
+    global appointments_offset
+    with db_lock:
+        if doctor_id not in users_db or users_db[doctor_id]["role"] != "medico":
+            return {"status": "error", "message": "Doctor no encontrado"}
+        if patient_id not in users_db or users_db[patient_id]["role"] != "paciente":
+            return {"status": "error", "message": "Paciente no encontrado"}
     
-    # Validar fecha y hora
-    try:
-        datetime.strptime(date, "%Y-%m-%d")
-        datetime.strptime(time, "%H:%M")
-    except ValueError:
-        return {"status": "error", "message": "Fecha u hora inválida"}
+        # Validar fecha y hora; "2030-1-1" y "9:00" se guardan como
+        # "2030-01-01" y "09:00" para que el índice de horarios los vea iguales
+        date, time = normalDate(date), normalTime(time)
+        if date is None or time is None:
+            return {"status": "error", "message": "Fecha u hora inválida"}
 
-    # Guardar cita en archivo
-    with open(appointments_file, "a", encoding="utf-8") as f:
-        f.write(f"{patient_id}|{doctor_id}|{date}|{time}\n")
-    return {"status": "ok", "message": "Cita agendada"}
+        # Guardar cita en archivo y en el índice
+        syncAppointments()
+        if slotTaken(appointment_slots.get((doctor_id, date), ()), minutesOf(time)):
+            return {"status": "error", "message": "Horario ocupado"}
+        line = f"{patient_id}|{doctor_id}|{date}|{time}\n".encode("utf-8")
+        with open(appointments_file, "ab") as f:
+            start = f.tell()
+            f.write(line)
+        if start == appointments_offset:
+            indexAppointment(patient_id, doctor_id, date, time)
+            appointments_offset = start + len(line)
+        else:
+            # Otro proceso escribió en el archivo: leer desde el último offset
+            syncAppointments()
+        bus.publish(doctor_id, "appointment_added", patient=patient_id, date=date, time=time)
+        return {"status": "ok", "message": "Cita agendada"}
 
 def listAppointments(doctor_id):
     """Listar todas las citas de un doctor"""
-    if doctor_id not in users_db or users_db[doctor_id]["role"] != "medico":
-        return {"status": "error", "message": "Doctor no encontrado"}
-    lines = []
-    if os.path.exists(appointments_file):
-        with open(appointments_file, "r", encoding="utf-8") as f:
-            lines = [l.strip() for l in f.readlines() if l.strip()]
-    appts = []
-    for line in lines:
-        parts = line.split("|")
-        if len(parts) >= 4:
-            pid, did, date, time = parts[:4]
-            if did == doctor_id:
-                appts.append({"patient": pid, "date": date, "time": time})
-    return {"status": "ok", "appointments": appts}
+    with db_lock:
+        if doctor_id not in users_db or users_db[doctor_id]["role"] != "medico":
+            return {"status": "error", "message": "Doctor no encontrado"}
+        syncAppointments()
+        return {"status": "ok", "appointments": list(appointments_by_doctor.get(doctor_id, ()))}
+
+def listPatientAppointments(patient_id):
+    """Listar todas las citas de un paciente"""
+    with db_lock:
+        if patient_id not in users_db or users_db[patient_id]["role"] != "paciente":
+            return {"status": "error", "message": "Paciente no encontrado"}
+        syncAppointments()
+        return {"status": "ok", "appointments": list(appointments_by_patient.get(patient_id, ()))}
+
+# ============================
+# Sala de espera
+# ============================
+
+def appointmentRoom(doctor_id, date, time):
+    """Sala del relay de media para la llamada de una cita"""
+    return f"cita-{doctor_id}-{date}-{time}"
+
+def nearestAppointment(patient_id, doctor_id):
+    """Cita del paciente con el doctor más cercana a la hora actual, o None"""
+    now = datetime.now()
+    best = None
+    for a in appointments_by_patient.get(patient_id, ()):
+        if a["doctor"] != doctor_id:
+            continue
+        try:
+            when = datetime.strptime(f"{a['date']} {a['time']}", "%Y-%m-%d %H:%M")
+        except ValueError:
+            continue
+        if best is None or abs(when - now) < best[0]:
+            best = (abs(when - now), a)
+    return best[1] if best else None
+
+def patientReady(patient_id, doctor_id):
+    """El paciente entra a la sala de espera del doctor; devuelve la sala de su cita"""
+    with db_lock:
+        if doctor_id not in users_db or users_db[doctor_id]["role"] != "medico":
+            return {"status": "error", "message": "Doctor no encontrado"}
+        if patient_id not in users_db or users_db[patient_id]["role"] != "paciente":
+            return {"status": "error", "message": "Paciente no encontrado"}
+        syncAppointments()
+        appointment = nearestAppointment(patient_id, doctor_id)
+        if appointment is None:
+            return {"status": "error", "message": "No tiene cita con este doctor"}
+        room = appointmentRoom(doctor_id, appointment["date"], appointment["time"])
+        since = datetime.now().isoformat(timespec="seconds")
+        waiting_room.setdefault(doctor_id, {})[patient_id] = {"since": since, "room": room}
+        bus.publish(doctor_id, "patient_ready", patient=patient_id,
+                    name=users_db[patient_id]["name"], since=since, room=room)
+        return {"status": "ok", "message": "En sala de espera", "room": room}
+
+def patientLeft(patient_id, doctor_id):
+    """El paciente sale de la sala de espera (atendido o cancelado)"""
+    with db_lock:
+        room = waiting_room.get(doctor_id, {})
+        if room.pop(patient_id, None) is None:
+            return {"status": "error", "message": "El paciente no está esperando"}
+        if not room:
+            del waiting_room[doctor_id]
+        bus.publish(doctor_id, "patient_left", patient=patient_id)
+        return {"status": "ok", "message": "Salió de la sala de espera"}
+
+def waitingPatients(doctor_id):
+    """Pacientes que esperan a un doctor, por orden de llegada"""
+    with db_lock:
+        if doctor_id not in users_db or users_db[doctor_id]["role"] != "medico":
+            return {"status": "error", "message": "Doctor no encontrado"}
+        patients = [{"patient": pid, "name": users_db[pid]["name"], **entry}
+                    for pid, entry in waiting_room.get(doctor_id, {}).items()]
+        return {"status": "ok", "patients": patients}
+
+def roomAccess(token, room, role):
+    """True si la sesión del token es el doctor o el paciente (según role) de la cita de room.
+
+    El relay de media lo consulta en cada conexión: sin esto cualquiera podría
+    entrar a una sala y escuchar la consulta.
+    """
+    user_id = sessionUser(token, role) if token else None
+    if user_id is None:
+        return False
+    with db_lock:
+        syncAppointments()
+        if role == "medico":
+            return any(appointmentRoom(user_id, a["date"], a["time"]) == room
+                       for a in appointments_by_doctor.get(user_id, ()))
+        return any(appointmentRoom(a["doctor"], a["date"], a["time"]) == room
+                   for a in appointments_by_patient.get(user_id, ()))
+
+# ============================
+# Importación / exportación masiva
+# ============================
+
+def importResult(count, errors):
+    """Respuesta común de las importaciones: filas aceptadas y rechazadas"""
+    return {"status": "ok", "imported": count, "rejected": len(errors), "errors": errors[:MAX_IMPORT_ERRORS]}
+
+def rowFields(row, fields):
+    """Valores (str) de fields en una fila dict, o None si falta alguno"""
+    try:
+        values = tuple(str(row[k]).strip() for k in fields)
+    except (KeyError, TypeError):
+        return None
+    return values if all(values) else None
+
+@lru_cache(maxsize=4096)
+def normalDate(value):
+    """Fecha como YYYY-MM-DD ("2030-1-1" -> "2030-01-01"), o None si no es válida.
+
+    Con caché: en una importación o al leer el archivo las fechas se repiten mucho.
+    """
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=4096)
+def normalTime(value):
+    """Hora como HH:MM ("3:00" -> "03:00"), o None si no es válida"""
+    try:
+        return datetime.strptime(value, "%H:%M").strftime("%H:%M")
+    except ValueError:
+        return None
+
+def registerUsers(rows):
+    """Registrar muchos usuarios con una sola escritura al log.
+
+    rows son dicts con name, id, role y password; las filas inválidas se
+    saltan y se informan con su posición. Una password que ya viene como
+    hash (sessions.HASH_PREFIX) se guarda tal cual, sin recalcularla.
+    """
+    # Primero se valida: el hash es lento a propósito y no se calcula para
+    # filas que se van a rechazar
+    accepted, errors, seen = [], [], set()
+    for i, row in enumerate(rows):
+        values = rowFields(row, ("name", "id", "role"))
+        if values is None or not row.get("password"):
+            errors.append({"row": i, "message": "Faltan campos"})
+            continue
+        name, uid, role = values
+        password = str(row["password"])
+        role = storage.legacy_roles.get(role, role)
+        if role not in ROLES:
+            errors.append({"row": i, "message": "Rol inválido"})
+            continue
+        if uid in seen or uid in users_db:
+            errors.append({"row": i, "message": "ID ya registrado"})
+            continue
+        seen.add(uid)
+        accepted.append((i, name, uid, role, password))
+
+    # Hashes en paralelo (pbkdf2_hmac suelta el GIL) y fuera del lock
+    with ThreadPoolExecutor(max(1, min(len(accepted), os.cpu_count() or 1))) as pool:
+        passwords = list(pool.map(storedPassword, [row[4] for row in accepted]))
+
+    with db_lock:
+        ops = []
+        for (i, name, uid, role, _), password in zip(accepted, passwords):
+            # Pudo registrarse mientras se calculaban los hashes
+            if uid in users_db:
+                errors.append({"row": i, "message": "ID ya registrado"})
+                continue
+            users_db[uid] = {"name": name, "role": role, "password": password}
+            indexRole(uid, role)
+            ops.append({"op": "register", "id": uid, "user": users_db[uid]})
+        storage.extend(users_db, ops)
+    errors.sort(key=lambda error: error["row"])
+    return importResult(len(ops), errors)
+
+def addAppointments(rows):
+    """Agregar muchas citas con una sola escritura a appointments_file.
+
+    rows son dicts con patient, doctor, date y time.
+    """
+    global appointments_offset
+    with db_lock:
+        syncAppointments()
+        added, errors = [], []
+        # Horarios tomados por filas anteriores del mismo lote
+        batch_slots = {}
+        for i, row in enumerate(rows):
+            values = rowFields(row, ("patient", "doctor", "date", "time"))
+            if values is None:
+                errors.append({"row": i, "message": "Faltan campos"})
+                continue
+            patient_id, doctor_id, date, time = values
+            if users_db.get(doctor_id, {}).get("role") != "medico":
+                errors.append({"row": i, "message": "Doctor no encontrado"})
+            elif users_db.get(patient_id, {}).get("role") != "paciente":
+                errors.append({"row": i, "message": "Paciente no encontrado"})
+            elif normalDate(date) is None or normalTime(time) is None:
+                errors.append({"row": i, "message": "Fecha u hora inválida"})
+            else:
+                date, time = normalDate(date), normalTime(time)
+                start = minutesOf(time)
+                batch = batch_slots.setdefault((doctor_id, date), [])
+                if slotTaken(appointment_slots.get((doctor_id, date), ()), start) or slotTaken(batch, start):
+                    errors.append({"row": i, "message": "Horario ocupado"})
+                    continue
+                insort(batch, start)
+                added.append((patient_id, doctor_id, date, time))
+        if added:
+            data = "".join([f"{p}|{d}|{date}|{time}\n" for p, d, date, time in added]).encode("utf-8")
+            with open(appointments_file, "ab") as f:
+                start = f.tell()
+                f.write(data)
+            if start == appointments_offset:
+                for values in added:
+                    indexAppointment(*values)
+                appointments_offset = start + len(data)
+            else:
+                syncAppointments()
+            # Un solo evento por doctor en vez de uno por cita
+            for doctor_id, count in Counter(values[1] for values in added).items():
+                bus.publish(doctor_id, "appointments_imported", count=count)
+        return importResult(len(added), errors)
+
+def exportUsers(role, limit=None, after=None):
+    """Página de usuarios de un rol, sin contraseñas"""
+    with db_lock:
+        page = rolePage(role, limit, after)
+        if page is None:
+            return {"status": "error", "message": "Cursor inválido"}
+        ids, next_cursor = page
+        rows = [{"id": uid, "name": users_db[uid]["name"], "role": role} for uid in ids]
+        return {"status": "ok", "users": rows, "next": next_cursor}
+
+def exportAppointments(limit, after=0):
+    """Página de citas en orden de archivo; "next" es el offset de la siguiente"""
+    with db_lock:
+        syncAppointments()
+        end = appointments_offset
+    if not 0 <= after <= end:
+        return {"status": "error", "message": "Cursor inválido"}
+    rows = []
+    position = after
+    if position < end:
+        with open(appointments_file, "rb") as f:
+            f.seek(position)
+            while position < end and len(rows) < limit:
+                raw = f.readline()
+                position += len(raw)
+                parsed = parseAppointmentLine(raw.decode("utf-8", "replace"))
+                if parsed:
+                    rows.append(dict(zip(("patient", "doctor", "date", "time"), parsed)))
+    return {"status": "ok", "appointments": rows, "next": position if position < end else None}
+
+# ============================
+# Índice de citas
+# ============================
+
+def parseAppointmentLine(line):
+    """(patient, doctor, date, time) de una línea de citas, o None.
+
+    appointments.txt tiene líneas separadas con "|" y otras más viejas con ",".
+    """
+    parts = [p.strip() for p in line.split("|" if "|" in line else ",")]
+    if len(parts) < 4 or not all(parts[:4]):
+        return None
+    return tuple(parts[:4])
+
+def indexAppointment(patient_id, doctor_id, date, time):
+    """Agregar una cita a los índices en memoria"""
+    global data_version
+    data_version += 1
+    # Las líneas viejas del archivo pueden tener "2030-1-1" o "3:00"
+    date, time = normalDate(date) or date, normalTime(time) or time
+    appointments_by_doctor.setdefault(doctor_id, []).append({"patient": patient_id, "date": date, "time": time})
+    appointments_by_patient.setdefault(patient_id, []).append({"doctor": doctor_id, "date": date, "time": time})
+    start = minutesOf(time)
+    if start is not None:
+        insort(appointment_slots.setdefault((doctor_id, date), []), start)
+
+def minutesOf(time):
+    """Minutos desde medianoche de una hora "H:MM", o None si no es válida"""
+    hours, _, minutes = time.partition(":")
+    try:
+        return int(hours) * 60 + int(minutes)
+    except ValueError:
+        return None
+
+def slotTaken(slots, start):
+    """True si una cita que empieza en start se pisa con alguna de slots (ordenada)"""
+    if start is None:
+        return False
+    i = bisect_left(slots, start - SLOT_MINUTES + 1)
+    return i < len(slots) and slots[i] < start + SLOT_MINUTES
+
+def freeSlots(doctor_id, first, last):
+    """Horarios libres de un doctor entre dos fechas (YYYY-MM-DD), sin leer disco"""
+    with db_lock:
+        if doctor_id not in users_db or users_db[doctor_id]["role"] != "medico":
+            return {"status": "error", "message": "Doctor no encontrado"}
+        try:
+            day = Date.fromisoformat(first)
+            end = Date.fromisoformat(last)
+        except ValueError:
+            return {"status": "error", "message": "Fecha inválida"}
+        if end < day or (end - day).days >= MAX_SLOT_DAYS:
+            return {"status": "error", "message": f"Rango inválido (máximo {MAX_SLOT_DAYS} días)"}
+        slots = {}
+        while day <= end:
+            date = day.isoformat()
+            taken = appointment_slots.get((doctor_id, date), ())
+            slots[date] = [f"{start // 60:02d}:{start % 60:02d}"
+                           for start in range(WORKDAY_START, WORKDAY_END - SLOT_MINUTES + 1, SLOT_MINUTES)
+                           if not slotTaken(taken, start)]
+            day += timedelta(days=1)
+        return {"status": "ok", "slot_minutes": SLOT_MINUTES, "slots": slots}
+
+def syncAppointments():
+    """Leer del archivo solo las citas añadidas desde la última lectura"""
+    global appointments_offset, data_version
+    with db_lock:
+        try:
+            size = os.path.getsize(appointments_file)
+        except OSError:
+            size = 0
+        if size < appointments_offset:
+            # El archivo fue truncado o reemplazado: reconstruir el índice
+            appointments_by_doctor.clear()
+            appointments_by_patient.clear()
+            appointment_slots.clear()
+            data_version += 1
+            appointments_offset = 0
+        if size == appointments_offset:
+            return
+        with open(appointments_file, "rb") as f:
+            f.seek(appointments_offset)
+            chunk = f.read(size - appointments_offset)
+        # Una línea sin salto final puede estar a medio escribir
+        end = chunk.rfind(b"\n") + 1
+        for raw in chunk[:end].splitlines():
+            parsed = parseAppointmentLine(raw.decode("utf-8", "replace"))
+            if parsed:
+                indexAppointment(*parsed)
+        appointments_offset += end
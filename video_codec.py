@@ -0,0 +1,210 @@
+# video_codec.py
+# Video con detección de cambios para av_call y el preview del relay.
+#
+# En una consulta casi todo el cuadro es fondo quieto, así que no hace falta
+# mandar cada frame entero:
+#   "full"  - cada frame es un JPEG completo (como antes; receptores viejos)
+#   "skip"  - si el frame no cambió se manda un marcador FLAG_REPEAT vacío
+#   "delta" - solo se codifican los tiles que cambiaron (FLAG_DELTA), con un
+#             keyframe completo (FLAG_KEYFRAME) cada KEYFRAME_INTERVAL
+#             segundos o cuando el receptor lo pide
+#
+# El cambio se mide sobre una versión reducida en gris (SAMPLES x SAMPLES
+# píxeles por tile) contra lo que el receptor ya tiene, así el ruido de la
+# cámara no dispara envíos y los cambios lentos se acumulan hasta mandarse.
+import struct
+import time
+import cv2
+import numpy as np
+from framing import FLAG_KEYFRAME, FLAG_DELTA, FLAG_REPEAT
+
+VIDEO_MODES = ("full", "skip", "delta")
+
+TILE = 64                 # lado del tile en píxeles (múltiplo del MCU de JPEG)
+SAMPLES = 8               # muestras por lado de tile para detectar cambios
+CHANGE_THRESHOLD = 2.5    # diferencia media de gris (0-255) para dar un tile por cambiado
+MAX_DELTA_FRACTION = 0.5  # con más tiles cambiados conviene un keyframe
+KEYFRAME_INTERVAL = 4.0   # segundos entre keyframes
+
+# Payload delta: ancho, alto, lado del tile, cantidad de tiles; después los
+# índices (uint16, fila * columnas + columna) y un JPEG con los tiles en fila
+DELTA_HEADER = struct.Struct('!HHHH')
+
+
+def negotiate_mode(wanted, offered):
+    """Modo a usar según lo que soporta el receptor (hello "video_modes")"""
+    return wanted if wanted in (offered or ("full",)) else "full"
+
+
+def tile_grid(width, height, tile=TILE):
+    """(filas, columnas) de tiles que cubren el frame"""
+    return -(-height // tile), -(-width // tile)
+
+
+class ChangeDetector:
+    """Tiles que cambiaron respecto de la última imagen confirmada con commit()"""
+
+    def __init__(self, tile=TILE, samples=SAMPLES, threshold=CHANGE_THRESHOLD):
+        self.tile = tile
+        self.samples = samples
+        self.threshold = threshold
+        self.size = None
+        self.reference = None
+        self.current = None
+
+    def changed(self, frame):
+        """Máscara (filas, columnas) de tiles cambiados; todo True si no hay referencia"""
+        h, w = frame.shape[:2]
+        rows, cols = tile_grid(w, h, self.tile)
+        # INTER_AREA sobre el frame entero cuesta casi lo mismo que codificarlo:
+        # primero se toma uno de cada tantos píxeles (INTER_NEAREST) y se
+        # promedian 2x2 por muestra, suficiente para que el ruido no cuente
+        w2, h2 = cols * self.samples, rows * self.samples
+        sub = cv2.resize(frame, (2 * w2, 2 * h2), interpolation=cv2.INTER_NEAREST)
+        small = cv2.resize(sub, (w2, h2), interpolation=cv2.INTER_AREA)
+        self.current = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.reference is None or self.size != (w, h):
+            self.size = (w, h)
+            self.reference = None
+            return np.ones((rows, cols), bool)
+        # Con arrays tan chicos numpy es más barato que soltar y volver a tomar
+        # el GIL en cada llamada a cv2 (importa con los otros hilos de la llamada)
+        diff = np.abs(self.current.astype(np.int16) - self.reference)
+        s = self.samples
+        return diff.reshape(rows, s, cols, s).mean(axis=(1, 3)) > self.threshold
+
+    def commit(self, mask=None):
+        """Tomar como referencia los tiles enviados (todos si mask es None)"""
+        if mask is None or self.reference is None:
+            self.reference = self.current.copy()
+            return
+        where = mask.repeat(self.samples, 0).repeat(self.samples, 1)
+        np.copyto(self.reference, self.current, where=where)
+
+
+class VideoEncoder:
+    """Codifica frames según el modo, con la escala y calidad de un RateController.
+
+    encode() devuelve (flags, payload) listo para transport.send, o None si
+    falló la codificación.
+    """
+
+    def __init__(self, rate, mode="full", keyframe_interval=KEYFRAME_INTERVAL):
+        if mode not in VIDEO_MODES:
+            raise ValueError(f"Modo de video desconocido: {mode}")
+        self.rate = rate
+        self.mode = mode
+        self.keyframe_interval = keyframe_interval
+        self.detector = ChangeDetector()
+        self.next_keyframe = 0.0
+        self.repeated = 0
+        self.deltas = 0
+        self.keyframes = 0
+
+    def request_keyframe(self):
+        """Mandar un frame completo en el próximo encode (p. ej. lo pidió el receptor)"""
+        self.next_keyframe = 0.0
+
+    def _jpeg(self, image):
+        ok, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), self.rate.quality])
+        return buffer if ok else None
+
+    def encode(self, frame):
+        frame = self.rate.prepare(frame)
+        if self.mode == "full":
+            buffer = self._jpeg(frame)
+            return None if buffer is None else (0, buffer)
+
+        mask = self.detector.changed(frame)
+        now = time.monotonic()
+        keyframe = self.mode == "delta" and (now >= self.next_keyframe or self.detector.reference is None)
+        if not keyframe and not mask.any():
+            self.repeated += 1
+            return FLAG_REPEAT, b''
+        if self.mode == "skip" or keyframe or mask.mean() > MAX_DELTA_FRACTION:
+            buffer = self._jpeg(frame)
+            if buffer is None:
+                return None
+            self.detector.commit()
+            if self.mode == "skip":
+                return 0, buffer
+            self.next_keyframe = now + self.keyframe_interval
+            self.keyframes += 1
+            return FLAG_KEYFRAME, buffer
+
+        buffer = self._delta(frame, mask)
+        if buffer is None:
+            return None
+        self.detector.commit(mask)
+        self.deltas += 1
+        return FLAG_DELTA, buffer
+
+    def _delta(self, frame, mask):
+        """Payload con los tiles de mask: índices + un JPEG con los tiles en fila"""
+        h, w = frame.shape[:2]
+        cols = mask.shape[1]
+        indices = np.flatnonzero(mask)
+        tile = TILE
+        strip = np.zeros((tile, tile * len(indices), 3), np.uint8)
+        for i, index in enumerate(indices):
+            y, x = divmod(int(index), cols)
+            y, x = y * tile, x * tile
+            part = frame[y:y + tile, x:x + tile]
+            strip[:part.shape[0], i * tile:i * tile + part.shape[1]] = part
+        jpeg = self._jpeg(strip)
+        if jpeg is None:
+            return None
+        header = DELTA_HEADER.pack(w, h, tile, len(indices))
+        return header + indices.astype('>u2').tobytes() + jpeg.tobytes()
+
+
+class NeedKeyframe(Exception):
+    """Llegó un delta sin una imagen base: hay que pedir un keyframe"""
+
+
+class VideoDecoder:
+    """Reconstruye la imagen a partir de frames completos, deltas y repeticiones"""
+
+    def __init__(self):
+        # Imagen actual (modo delta); se entrega de solo lectura porque el
+        # render no debe modificarla
+        self.canvas = None
+
+    def decode(self, flags, payload, imread_flags=cv2.IMREAD_COLOR):
+        """Frame a mostrar, o None si no hay nada nuevo.
+
+        imread_flags (decodificación reducida) solo se usa en frames que no
+        son del modo delta. Lanza NeedKeyframe si falta la imagen base.
+        """
+        if flags & FLAG_REPEAT:
+            return None
+        data = np.frombuffer(payload, np.uint8)
+        if flags & FLAG_KEYFRAME:
+            frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+            if frame is not None:
+                frame.flags.writeable = False
+                self.canvas = frame
+            return frame
+        if not flags & FLAG_DELTA:
+            self.canvas = None
+            return cv2.imdecode(data, imread_flags)
+
+        w, h, tile, count = DELTA_HEADER.unpack_from(payload)
+        if self.canvas is None or self.canvas.shape[:2] != (h, w):
+            raise NeedKeyframe()
+        start = DELTA_HEADER.size
+        indices = np.frombuffer(payload, '>u2', count, start)
+        strip = cv2.imdecode(data[start + 2 * count:], cv2.IMREAD_COLOR)
+        if strip is None:
+            raise NeedKeyframe()
+        # Solo el hilo de decodificación toca la imagen: el render la copia
+        canvas = self.canvas
+        canvas.flags.writeable = True
+        cols = -(-w // tile)
+        for i, index in enumerate(indices):
+            y, x = divmod(int(index), cols)
+            y, x = y * tile, x * tile
+            part = canvas[y:y + tile, x:x + tile]
+            part[:] = strip[:part.shape[0], i * tile:i * tile + part.shape[1]]
+        canvas.flags.writeable = False
+        return canvas
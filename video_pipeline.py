@@ -0,0 +1,307 @@
+# video_pipeline.py
+# Pipeline de recepción de video por etapas: recepción -> decodificación ->
+# render. Las etapas se comunican con colas de un solo lugar: si la etapa
+# siguiente va atrasada, el frame viejo se reemplaza por el nuevo (gana el
+# último) en vez de acumularse, así la latencia no crece. Los deltas de
+# video_codec no se pueden saltear: se juntan hasta el próximo frame completo.
+import json
+import threading
+import time
+import cv2
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap
+from framing import VIDEO, CONTROL, FLAG_HELLO, FLAG_KEYFRAME, FLAG_DELTA, FLAG_REPEAT, timestamp_us
+from metrics import Registry
+from video_codec import VideoDecoder, NeedKeyframe
+
+# Últimas muestras de latencia que se guardan para los percentiles en vivo
+LATENCY_SAMPLES = 1000
+
+# Mínimo de segundos entre pedidos de keyframe al emisor
+KEYFRAME_REQUEST_INTERVAL = 0.5
+
+# imdecode puede reducir un JPEG 2, 4 u 8 veces al decodificarlo, mucho más
+# barato que decodificarlo entero y después achicarlo
+REDUCED_DECODE = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                  (2, cv2.IMREAD_REDUCED_COLOR_2), (1, cv2.IMREAD_COLOR))
+
+
+class LatestSlot:
+    """Cola de un elemento: put() reemplaza el elemento no consumido.
+
+    Con merge(pendiente, nuevo), el elemento guardado es lo que devuelva
+    merge en vez del nuevo (se llama con el lock tomado).
+    """
+
+    def __init__(self, merge=None):
+        self.cond = threading.Condition()
+        self.item = None
+        self.full = False
+        self.closed = False
+        self.dropped = 0
+        self.merge = merge
+
+    def put(self, item):
+        """Guardar item; devuelve True si el lugar estaba vacío"""
+        with self.cond:
+            was_empty = not self.full
+            if self.full and self.merge is not None:
+                item = self.merge(self.item, item)
+            elif self.full:
+                self.dropped += 1
+            self.item = item
+            self.full = True
+            self.cond.notify()
+            return was_empty
+
+    def get(self, block=True):
+        """Sacar el elemento (esperando si block); None si se cerró o está vacío"""
+        with self.cond:
+            while block and not self.full and not self.closed:
+                self.cond.wait()
+            if not self.full:
+                return None
+            item, self.item, self.full = self.item, None, False
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class FrameRenderer:
+    """Escala frames BGR al tamaño de un label en buffers reutilizados.
+
+    Cada frame se escala con cv2.resize(dst=...) sobre un array preasignado
+    y se pasa a RGB en el mismo array, ya al tamaño final; el QImage que lo
+    envuelve se crea una vez por buffer. Un frame que ya tiene el tamaño
+    final (y es nuestro) se convierte en su lugar, sin copiarlo.
+
+    Format_BGR888 evitaría el cambio de canales, pero QPixmap.fromImage lo
+    convierte por un camino genérico que cuesta más del doble que el swap.
+
+    render() puede correr en otro hilo que el de Qt: hay varios buffers y
+    nunca se escribe en el último entregado ni en el que se está mostrando
+    (ver take()/release()).
+    """
+
+    def __init__(self, width, height, buffers=3):
+        self.width = width
+        self.height = height
+        self.count = buffers
+        self.lock = threading.Lock()
+        self.size = None
+        self.buffers = []     # [(array, QImage)]
+        self.last = None      # índice del último buffer entregado
+        self.showing = None   # índice del buffer que usa el hilo de Qt
+
+    def resize(self, width, height):
+        """Cambiar el tamaño del label (los buffers se rehacen en el próximo frame)"""
+        self.width, self.height = width, height
+
+    def target_size(self, w, h):
+        """Tamaño escalado manteniendo la proporción"""
+        scale = min(self.width / w, self.height / h)
+        return max(1, int(w * scale)), max(1, int(h * scale))
+
+    def render(self, frame):
+        """(índice, QImage, array) con el frame escalado; el array mantiene viva la imagen"""
+        h, w = frame.shape[:2]
+        size = self.target_size(w, h)
+        if size == (w, h) and frame.flags.c_contiguous and frame.flags.writeable:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+            return None, QImage(frame.data, w, h, frame.strides[0], QImage.Format_RGB888), frame
+        with self.lock:
+            if size != self.size:
+                self.size = size
+                self.buffers = [self._buffer(size) for _ in range(self.count)]
+                self.last = self.showing = None
+            index = next(i for i in range(self.count) if i != self.last and i != self.showing)
+            self.last = index
+            array, image = self.buffers[index]
+        # INTER_AREA solo vale la pena al achicar mucho; cerca de 1:1 es
+        # varias veces más lento que la interpolación lineal
+        interpolation = cv2.INTER_AREA if size[0] * 2 <= w else cv2.INTER_LINEAR
+        cv2.resize(frame, size, dst=array, interpolation=interpolation)
+        cv2.cvtColor(array, cv2.COLOR_BGR2RGB, dst=array)
+        return index, image, array
+
+    def _buffer(self, size):
+        w, h = size
+        array = np.empty((h, w, 3), np.uint8)
+        return array, QImage(array.data, w, h, array.strides[0], QImage.Format_RGB888)
+
+    def take(self, slot):
+        """Sacar el frame pendiente de slot y marcar su buffer como en uso"""
+        with self.lock:
+            item = slot.get(block=False)
+            self.showing = item[0] if item is not None else None
+            return item
+
+    def release(self):
+        with self.lock:
+            self.showing = None
+
+
+class VideoPipeline(QObject):
+    """Recibe frames de un transporte y los muestra en un QLabel.
+
+    - recepción: hilo que lee del transporte y deja el payload en un slot
+    - decodificación: hilo que reconstruye el frame (VideoDecoder) y lo
+      escala al QImage (FrameRenderer)
+    - render: en el hilo de Qt, avisado con la señal frame_ready
+
+    Las estadísticas van a metrics (un metrics.Registry, el de la llamada).
+    """
+    frame_ready = pyqtSignal()
+
+    def __init__(self, transport, label, display_width, display_height, metrics=None):
+        super().__init__()
+        self.transport = transport
+        self.label = label
+        self.display_width = display_width
+        self.display_height = display_height
+        self.renderer = FrameRenderer(display_width, display_height)
+        # Tamaño original de los frames que llegan (para decodificar reducido)
+        self.source_size = None
+        self.decoder = VideoDecoder()
+        self.last_seq = None
+        self.keyframe_requested = 0.0
+        # Cada elemento es una lista de (seq, timestamp, flags, payload)
+        self.encoded = LatestSlot(merge=self._merge)
+        self.decoded = LatestSlot()
+        self.metrics = metrics = metrics if metrics is not None else Registry()
+        self.received = metrics.counter("frames_received", stream="video")
+        self.decoded_frames = metrics.counter("frames_decoded", stream="video")
+        self.rendered = metrics.counter("frames_rendered", stream="video")
+        self.repeated = metrics.counter("frames_repeated", stream="video")
+        self.keyframe_requests = metrics.counter("keyframe_requests", stream="video")
+        self.decode_ms = metrics.histogram("decode_ms", window=LATENCY_SAMPLES, stream="video")
+        # Latencia de cada frame mostrado: ahora menos el timestamp de captura
+        # del emisor (tiene sentido si los relojes están sincronizados)
+        self.latency_ms = metrics.histogram("latency_ms", window=LATENCY_SAMPLES, stream="video")
+        metrics.gauge("frames_dropped", fn=lambda: getattr(self.transport, "dropped", 0), stage="network")
+        metrics.gauge("frames_dropped", fn=lambda: self.encoded.dropped, stage="decode")
+        metrics.gauge("frames_dropped", fn=lambda: self.decoded.dropped, stage="render")
+        metrics.gauge("queue_depth", fn=lambda: int(self.encoded.full), stage="decode")
+        metrics.gauge("queue_depth", fn=lambda: int(self.decoded.full), stage="render")
+        self.receive_cpu = metrics.gauge("cpu_seconds", thread="video_receive")
+        self.decode_cpu = metrics.gauge("cpu_seconds", thread="video_decode")
+        # Llamado con cada mensaje de control (dict) que llega por el stream
+        self.on_control = None
+        # El render tiene que correr en el hilo del label
+        self.moveToThread(label.thread())
+        self.frame_ready.connect(self._render)
+
+    def start(self):
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+        threading.Thread(target=self._decode_loop, daemon=True).start()
+
+    def _receive_loop(self):
+        try:
+            while True:
+                message = self.transport.recv()
+                if message is None:
+                    print("Video connection closed.")
+                    break
+                stream, flags, seq, timestamp, payload = message
+                if stream == CONTROL:
+                    if self.on_control is not None and not flags & FLAG_HELLO:
+                        self.on_control(json.loads(bytes(payload)))
+                    continue
+                if stream != VIDEO:
+                    continue
+                self.received.inc()
+                # Si se perdió un frame, los deltas siguientes no tienen base
+                if self.last_seq is not None and seq != (self.last_seq + 1) & 0xFFFFFFFF \
+                        and self.decoder.canvas is not None:
+                    self.request_keyframe()
+                self.last_seq = seq
+                # El payload es un view sobre el buffer del lector: copiarlo
+                self.encoded.put([(seq, timestamp, flags, bytes(payload))])
+                self.receive_cpu.set(time.thread_time())
+        except Exception as e:
+            print("Video recv error:", e)
+            self.metrics.counter("errors", stream="video", direction="recv").inc()
+        finally:
+            self.encoded.close()
+
+    def _merge(self, pending, new):
+        """Un frame completo reemplaza lo pendiente; un delta se agrega"""
+        flags = new[0][2]
+        if flags & FLAG_REPEAT:
+            return pending
+        if flags & FLAG_DELTA:
+            return pending + new
+        self.encoded.dropped += len(pending)
+        return new
+
+    def request_keyframe(self):
+        """Pedirle al emisor un frame completo (como mucho cada KEYFRAME_REQUEST_INTERVAL)"""
+        now = time.monotonic()
+        if now - self.keyframe_requested < KEYFRAME_REQUEST_INTERVAL:
+            return
+        self.keyframe_requested = now
+        self.keyframe_requests.inc()
+        try:
+            self.transport.send_control({"keyframe": True})
+        except OSError as e:
+            print("Keyframe request error:", e)
+
+    def _decode_loop(self):
+        while True:
+            items = self.encoded.get()
+            if items is None:
+                break
+            start = time.perf_counter()
+            frame = None
+            for _seq, item_timestamp, flags, payload in items:
+                factor, imread_flags = self._decode_mode()
+                try:
+                    decoded = self.decoder.decode(flags, payload, imread_flags)
+                except NeedKeyframe:
+                    self.request_keyframe()
+                    continue
+                if decoded is None:
+                    if flags & FLAG_REPEAT:
+                        self.repeated.inc()
+                    continue
+                frame, timestamp = decoded, item_timestamp
+                if not flags & (FLAG_KEYFRAME | FLAG_DELTA):
+                    self.source_size = (frame.shape[1] * factor, frame.shape[0] * factor)
+            if frame is None:
+                continue
+            image = self.renderer.render(frame) + (timestamp,)
+            self.decode_ms.observe((time.perf_counter() - start) * 1000)
+            self.decoded_frames.inc()
+            self.decode_cpu.set(time.thread_time())
+            # Solo se avisa al hilo de Qt si no tenía ya un frame pendiente
+            if self.decoded.put(image):
+                self.frame_ready.emit()
+
+    def _decode_mode(self):
+        """(factor, flags) de imdecode: la mayor reducción que sigue cubriendo el label"""
+        if self.source_size is None:
+            return REDUCED_DECODE[-1]
+        w, h = self.source_size
+        for factor, flags in REDUCED_DECODE:
+            if w // factor >= self.display_width and h // factor >= self.display_height:
+                return factor, flags
+        return REDUCED_DECODE[-1]
+
+    def resize(self, display_width, display_height):
+        self.display_width, self.display_height = display_width, display_height
+        self.renderer.resize(display_width, display_height)
+
+    def _render(self):
+        item = self.renderer.take(self.decoded)
+        if item is None:
+            return
+        try:
+            self.label.setPixmap(QPixmap.fromImage(item[1]))
+        finally:
+            self.renderer.release()
+        self.rendered.inc()
+        self.latency_ms.observe((timestamp_us() - item[3]) / 1000)